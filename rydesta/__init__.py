@@ -1,4 +1,4 @@
 from .error import RyError
-from .master import Master
+from .master import Master, ENGINES
 from .reader import Reader, pretty
 from .machine import RyState, visit
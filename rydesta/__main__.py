@@ -5,12 +5,30 @@ Commands:
   suite   Evaluate the tests of 'suite/'.
 
 Options:
-  -t --time   Display bootstrap time and time a feed takes.
+  -t --time      Display bootstrap time and time a feed takes, and how many
+                 calls the inline caches of call sites sped up.
+  -p --packrat   Memoize the reader's rules (packrat parsing); together with
+                 --time, display how many re-parses that avoided (files read
+                 from the on-disk cache are not parsed at all).
+  -n --no-cache  Do not use (or write) the on-disk cache of parsed files.
+  -e --engine=E  Evaluate with engine E: 'tree' walks the tree of every node,
+                 'closures' compiles nodes into closures first, 'vm' into
+                 bytecode [default: tree].
+  -d --dis       Print the bytecode of every top-level node before evaluating
+                 it (implies --engine=vm).
+  --depth=N      How many frames deep the 'vm' engine may recurse before it
+                 dies [default: 100000].
+  -f --floats    Make the results of arithmetic that are not integers floats
+                 instead of exact fractions.
+  -r --reload    Evaluate a module needed again if its file was modified
+                 since it was evaluated (e.g., in the REPL).
 """
 
 import sys
 import docopt
 import rydesta
+import rydesta.vm
+import rydesta.machine
 import pathlib
 import readline
 
@@ -23,11 +41,21 @@ class RyCLI:
   VERSION = 'Rydesta rev. 001'
 
   @staticmethod
-  def _master(filename):
+  def _master(filename, args):
     """Properly initialize a new master."""
-    master = rydesta.Master(filename)
+    if args['--dis']:
+      args['--engine'] = 'vm'
+    if args['--engine'] not in rydesta.ENGINES:
+      sys.exit(f'No such engine: "{args["--engine"]}"')
+    if not args['--depth'].isdigit() or int(args['--depth']) < 1:
+      sys.exit(f'Depth must be a number of frames, 1 or more, got "{args["--depth"]}"')
+    master = rydesta.Master(filename,
+      packrat=args['--packrat'], cache=not args['--no-cache'], engine=args['--engine'],
+      depth=int(args['--depth']), floats=args['--floats'], reload=args['--reload'])
     master.kernel()
     master.boot()
+    if args['--dis']:
+      master.trace = lambda node: print(rydesta.vm.disassemble(node))
     return master
 
   @staticmethod
@@ -49,6 +77,28 @@ class RyCLI:
       return result
     return timee()
 
+  @staticmethod
+  def _packrat(args, master, reported):
+    """Report the re-parses the reader of `master` avoided, and those of the
+       reader of the booted image (which read the basis) unless it is among
+       the readers already `reported`: the masters of the suite share it."""
+    if args['--time'] and args['--packrat']:
+      readers = {master.reader}
+      if master.overlay is not None:
+        readers.add(master.image()[1])
+      avoided = sum(reader.reparses_avoided for reader in readers - reported)
+      reported |= readers
+      print(f'[PACKRAT] {avoided} re-parse(s) avoided')
+
+  @staticmethod
+  def _sites(args, before):
+    """Report the hits and misses of the inline caches since `before`, a
+       snapshot of SITE_STATS: they are counted for the whole process."""
+    if args['--time']:
+      stats = rydesta.machine.SITE_STATS
+      hits, misses = stats['hits'] - before['hits'], stats['misses'] - before['misses']
+      print(f'[SITES] {hits} inline cache hit(s), {misses} miss(es)')
+
   @staticmethod
   def enter():
     """The argument-parser and argument-evaluator of Rydesta."""
@@ -57,23 +107,30 @@ class RyCLI:
       file = pathlib.Path(args['SCRIPT'])
       if not file.exists():
         sys.exit(f'No such file: "{file}"')
+      before = dict(rydesta.machine.SITE_STATS)
       master = RyCLI._time(args['--time'],
-        lambda: RyCLI._master(file.absolute()), 'bootstrap')
+        lambda: RyCLI._master(file.absolute(), args), 'bootstrap')
       try:
-        RyCLI._time(args['--time'], lambda: master.feed(file.read_text()))
+        RyCLI._time(args['--time'], lambda: master.feed_file(file))
       except rydesta.RyError as error:
         RyCLI._report(error)
+      RyCLI._packrat(args, master, set())
+      RyCLI._sites(args, before)
     elif args['suite']:
       suite = pathlib.Path('suite')
+      reported = set()
       for file in sorted(suite.glob('[0-9]*.ry')):
         print(f'--- {file} ---')
+        before = dict(rydesta.machine.SITE_STATS)
         master = RyCLI._time(args['--time'],
-          lambda: RyCLI._master(file.absolute()), 'bootstrap')
+          lambda: RyCLI._master(file.absolute(), args), 'bootstrap')
         RyCLI._time(args['--time'],
-          lambda: master.feed(file.read_text()))
+          lambda: master.feed_file(file))
+        RyCLI._packrat(args, master, reported)
+        RyCLI._sites(args, before)
     else:
       master = RyCLI._time(
-        args['--time'], lambda: RyCLI._master('<interactive>'), 'bootstrap')
+        args['--time'], lambda: RyCLI._master('<interactive>', args), 'bootstrap')
       print(f'Welcome to {RyCLI.VERSION}!', 'Good luck!', sep='\n')
       while True:
         line = input(' * ').strip()
@@ -0,0 +1,84 @@
+import sys
+import pickle
+import hashlib
+
+from . import reader
+from pathlib import Path
+
+
+# Parsed nodes are only as good as the reader that made them. Whenever the
+# reader (or Python, which does the pickling) changes, so does this.
+INTERPRETER = hashlib.sha1(
+  Path(reader.__file__).read_bytes() + sys.version.encode()).hexdigest()
+
+
+class ParseCache:
+  """An on-disk cache of the top-level nodes a source file is read into.
+
+  Reading is interleaved with evaluation, which may change the grammar between
+  two top-level nodes (think of `needs`, or `#:set-precedence`). So each node is
+  stored together with the fingerprint of the reader it was read by, the
+  position it was read at, and the grammar changes reading it made. A node is
+  replayed only while the fingerprints agree; after the first disagreement, the
+  reader resumes reading the source itself from that node's position on.
+
+  Cache files live in `__rycache__` next to the source, and are ignored (and
+  later overwritten) if the source or the interpreter changed."""
+
+  def __init__(self, filename):
+    filename = Path(filename)
+    self.file = filename.parent / '__rycache__' / f'{filename.name}.pickle'
+    self.key = INTERPRETER, self._digest(filename)
+    self.cached = self._load()
+    self.records = []
+    self.resume = None
+
+  @staticmethod
+  def _digest(filename, chunk=2**16):
+    """Hash the source file a chunk at a time."""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as file:
+      for piece in iter(lambda: file.read(chunk), b''):
+        digest.update(piece)
+    return digest.hexdigest()
+
+  def _load(self):
+    try:
+      with open(self.file, 'rb') as file:
+        key, records = pickle.load(file)
+    except (OSError, pickle.PickleError, EOFError, ValueError, TypeError):
+      return []
+    return records if key == self.key else []
+
+  def replay(self, fingerprint):
+    """If the next cached node was read under the given fingerprint, return it
+       together with the journal of grammar changes to re-apply. Otherwise,
+       stop replaying and return None; `resume` is then the position (and line)
+       to read the source from, if it is not the start."""
+    index = len(self.records)
+    if index < len(self.cached):
+      record = self.cached[index]
+      if record[0] == fingerprint:
+        self.records.append(record)
+        _, _, node, journal = record
+        return pickle.loads(node), journal
+      self.resume = record[1]
+      self.cached = []
+    else:
+      self.resume = None
+    return None
+
+  def record(self, fingerprint, start, node, journal):
+    """Remember a node read anew from `start`, and the grammar changes it made."""
+    self.records.append((fingerprint, start, pickle.dumps(node), journal))
+
+  def save(self):
+    """Write the cache file; keep quiet if it cannot be written."""
+    try:
+      self.file.parent.mkdir(exist_ok=True)
+      temporary = self.file.with_suffix('.tmp')
+      with open(temporary, 'wb') as file:
+        pickle.dump((self.key, self.records), file)
+      temporary.replace(self.file)
+    except OSError:
+      pass
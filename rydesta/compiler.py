@@ -0,0 +1,367 @@
+"""
+The closure-compiling engine of Rydesta. Rather than walking the tree of a node
+every time it is evaluated (see `machine._visit_node`), the node is compiled once
+into nested Python closures, each taking the state to evaluate in. Function
+bodies are compiled together with the function's definition, and are run by a
+trampoline: calls in tail position do not call, but return a _Tail for the
+trampoline to continue with.
+"""
+
+from .machine import (
+  RyBool, RyVec, RyNothing, RyExcerpt, RyBuiltin, RyTypeType, RyVariations,
+  _ReturnException, _die, _equals, _visit_pattern,
+  _CaseTable, _plan_cases, _define, _define_object, _needs, _unquote, _convert, _dispatch,
+  _call_builtin, _instantiate, _builtin, _route, _constant, _string, _dict)
+
+
+class _Tail:
+  """What a call in tail position returns instead of making the call: the
+     variation to continue with, and the capsule to evaluate its body in."""
+
+  __slots__ = 'variation', 'capsule'
+
+  def __init__(self, variation, capsule):
+    self.variation = variation
+    self.capsule = capsule
+
+
+###- ENTRY -##############
+
+def evaluate(S, node):
+  """Evaluate a node (or a list of nodes) in the given state, compiling it
+     first if it was not yet."""
+  if type(node) in (list, tuple):
+    try:
+      return [evaluate(S, x) for x in node]
+    except RecursionError:
+      _die(S, 'recursion error: recursion too deep :(')
+  return _compile(node)(S)
+
+
+def _run(call):
+  """The trampoline. Evaluate the body of the variation of the call (a _Tail)
+     in its capsule, and then the bodies of the variations it tail-calls, until
+     there is a value. The call is moved on in place, so that the capsules it
+     is done with are not kept by whoever made it."""
+  try:
+    while True:
+      if call.variation.code is None:
+        return RyNothing()
+      result = call.variation.code(call.capsule)
+      if type(result) is not _Tail:
+        return result
+      call.variation, call.capsule = result.variation, result.capsule
+  except _ReturnException as ret:
+    return ret.value
+  except RecursionError:
+    _die(call.capsule, 'recursion error: recursion too deep :(')
+
+
+###- COMPILER -##############
+
+# Nodes whose compiled closure differs in tail position.
+_TAILING = {'Cases', 'If', 'Ret', 'ForBlock', 'Call'}
+
+
+def _compile(node, tail=False):
+  """Compile a node into a closure. If the node is in `tail` position, calls
+     it makes last are returned as _Tail, and `ret` is its value. Out of tail
+     position, the closure is kept in the node, and made only once."""
+  if tail and node.type in _TAILING:
+    return _COMPILERS[node.type](node, True)
+  try:
+    return node.closure
+  except AttributeError:
+    try:
+      compiler = _COMPILERS[node.type]
+    except KeyError:
+      raise NotImplementedError(f'internal error: .compile: {node}')
+    node.closure = closure = compiler(node, False)
+    return closure
+
+
+def _compile_body(nodes, tail):
+  """Compile a non-empty list of nodes evaluated one after another; the value
+     of the last one is the value of them all."""
+  *init, last = [*map(_compile, nodes[:-1]), _compile(nodes[-1], tail)]
+  if not init:
+    return last
+  def body(S):
+    for statement in init:
+      statement(S)
+    return last(S)
+  return body
+
+
+def _compile_cases(node, tail):
+  line = node.line
+  head = _compile(node.head)
+  def branch(case):
+    # Bodies of the cases that are empty evaluate to true.
+    return _compile_body(case.body, tail) if case.body else None
+  arms = []
+  for case in _plan_cases(node):
+    if type(case) is _CaseTable:
+      # The table picks the case, and so the body, of those it has.
+      arms.append((case, None, {each: branch(each) for each in case.cases}))
+    elif case.type == 'MatchCase':
+      arms.append((case.cond, None, branch(case)))
+    else:
+      arms.append((None, _compile(case.cond), branch(case)))
+  def cases(S):
+    S.line = line
+    value = head(S)
+    for pattern, cond, body in arms:
+      if cond is not None:
+        status = _equals(cond(S), value)
+      elif type(pattern) is _CaseTable:
+        case = pattern.pick(S, value)
+        status, body = case is not None, body.get(case)
+      else:
+        # In cases, P_Discard has the highest priority.
+        status = pattern.type == 'P_Discard' or _visit_pattern(S, pattern, value)[0]
+      if status:
+        return RyBool(True) if body is None else body(S)
+    return RyBool(False)
+  return cases
+
+
+def _compile_function(node, tail):
+  line = node.line
+  code = None
+  if node.body:
+    # Ignore the last-line return.
+    last = node.body[-1]
+    code = _compile_body([*node.body[:-1], last.value if last.type == 'Ret' else last], True)
+  def function(S):
+    S.line = line
+    return _define(S, node, code)
+  return function
+
+
+def _compile_if(node, tail):
+  line = node.line
+  cond = _compile(node.cond)
+  correct = _compile_body(node.correct, tail) if node.correct else None
+  other = _compile_body(node.other, tail) if node.other else None
+  def if_(S):
+    S.line = line
+    value = cond(S)
+    if not (isinstance(value, RyBool) and value.value is False):
+      # If the body is empty, just return true.
+      return RyBool(True) if correct is None else correct(S)
+    # If there is no `else` clause and the condition is false, return false.
+    return RyBool(False) if other is None else other(S)
+  return if_
+
+
+def _compile_object(node, tail):
+  line = node.line
+  def object_(S):
+    S.line = line
+    return _define_object(S, node)
+  return object_
+
+
+def _compile_ret(node, tail):
+  if tail:
+    # A `ret` the body ends with is what the body evaluates to.
+    return _compile(node.value, True)
+  line = node.line
+  value = _compile(node.value)
+  def ret(S):
+    S.line = line
+    raise _ReturnException(value(S))
+  return ret
+
+
+def _compile_for_block(node, tail):
+  line = node.line
+  body = _compile_body(node.functions, tail)
+  def for_block(S):
+    S.line = line
+    return body(S)
+  return for_block
+
+
+def _compile_needs(node, tail):
+  line = node.line
+  def needs(S):
+    S.line = line
+    return _needs(S, node)
+  return needs
+
+
+def _compile_assign(node, tail):
+  line = node.line
+  value = _compile(node.value)
+  pattern = node.pattern
+  def assign(S):
+    S.line = line
+    result = value(S)
+    status, payload = _visit_pattern(S, pattern, result)
+    return _die(S, f'match error: {payload}') if not status else result
+  return assign
+
+
+def _compile_call(node, tail):
+  line = node.line
+  # Special forms look like calls, but are not calls.
+  if node.callee.type == 'Request' and len(node.args) == 1:
+    if node.callee.name == 'unquote':
+      quoted = _compile(node.args[0])
+      def unquote(S):
+        S.line = line
+        return _unquote(S, quoted(S))
+      return unquote
+    elif node.callee.name == 'quote':
+      excerpt = node.args[0]
+      def quote(S):
+        S.line = line
+        return RyExcerpt(S, excerpt)
+      return quote
+  callee = _compile(node.callee)
+  excerpts = node.args
+  args = [*map(_compile, node.args)]
+  def call(S):
+    S.line = line
+    function = callee(S)
+    if isinstance(function, RyVariations):
+      if function.quoting:
+        # Quoting functions excerpt all arguments they received, without evaluation.
+        values = [RyExcerpt(S, arg) for arg in excerpts]
+      else:
+        values = [arg(S) for arg in args]
+      pending = _Tail(*_dispatch(S, function, values, node))
+      if tail:
+        return pending
+      # Nor are the values kept: a seq given to a function that tail-calls
+      # itself with the rest of it may then be let go of as it is pulled.
+      del values
+      return _run(pending)
+    elif isinstance(function, RyBuiltin):
+      return _call_builtin(S, function, [arg(S) for arg in args])
+    elif isinstance(function, RyTypeType) and len(args) == 1:
+      return _convert(S, function, args[0](S))
+    _die(S, f'callee of type {function.type} is not callable: {function}')
+  return call
+
+
+def _compile_instance(node, tail):
+  line = node.line
+  callee = _compile(node.callee)
+  args = [*map(_compile, node.args)]
+  def instance(S):
+    S.line = line
+    obj = callee(S)
+    return _instantiate(S, obj, [arg(S) for arg in args])
+  return instance
+
+
+def _compile_builtin(node, tail):
+  line = node.line
+  name = node.name
+  def builtin(S):
+    S.line = line
+    return _builtin(S, name)
+  return builtin
+
+
+def _compile_path(node, tail):
+  line = node.line
+  parent = _compile(node.parent)
+  path = node.path
+  def path_(S):
+    S.line = line
+    return _route(S, parent(S), path)
+  return path_
+
+
+def _compile_request(node, tail):
+  line = node.line
+  name = node.name
+  def request(S):
+    S.line = line
+    try:
+      return S.env[name]
+    except KeyError:
+      _die(S, f'"{name}" is not defined')
+  return request
+
+
+def _compile_expect(node, tail):
+  line = node.line
+  guard = _compile(node.guard)
+  def expect(S):
+    S.line = line
+    # Evaluate the guard; die if it's false.
+    value = guard(S)
+    if isinstance(value, RyBool) and value.value == False:
+      _die(S, f'expectation false')
+    return RyNothing()
+  return expect
+
+
+def _compile_constant(node):
+  line = node.line
+  value = _constant(node)
+  def constant(S):
+    S.line = line
+    return value
+  return constant
+
+
+def _compile_vector(node, tail):
+  if _constant(node) is not None:
+    return _compile_constant(node)
+  line = node.line
+  items = [*map(_compile, node.items)]
+  def vector(S):
+    S.line = line
+    return RyVec([item(S) for item in items])
+  return vector
+
+
+def _compile_dict(node, tail):
+  line = node.line
+  pairs = [(_compile(key), _compile(value)) for key, value in zip(node.keys, node.values)]
+  def dict_(S):
+    S.line = line
+    return _dict(S, [(key(S), value(S)) for key, value in pairs])
+  return dict_
+
+
+def _compile_number(node, tail):
+  return _compile_constant(node)
+
+
+def _compile_string(node, tail):
+  if _constant(node) is not None:
+    return _compile_constant(node)
+  line = node.line
+  def string(S):
+    S.line = line
+    return _string(S, node)
+  return string
+
+
+_COMPILERS = {
+  'Cases': _compile_cases,
+  'Function': _compile_function,
+  'If': _compile_if,
+  'Object': _compile_object,
+  'Ret': _compile_ret,
+  'ForBlock': _compile_for_block,
+  'Needs': _compile_needs,
+  'Assign': _compile_assign,
+  'Call': _compile_call,
+  'Instance': _compile_instance,
+  'Builtin': _compile_builtin,
+  'Path': _compile_path,
+  'Request': _compile_request,
+  'Expect': _compile_expect,
+  'Vector': _compile_vector,
+  'Dict': _compile_dict,
+  'Number': _compile_number,
+  'String': _compile_string,
+}
@@ -0,0 +1,184 @@
+"""
+A persistent hash map: a hash array mapped trie. Every change makes a new
+map, which shares all but the path to the changed entry with the old one, so
+a map is never changed once made. Getting, putting and dropping a key walk
+one path, which is at most 13 nodes deep (a node takes 5 bits of the hash),
+and so are O(1) for any map that fits in memory.
+
+Keys are any hashable Python values; see `machine._key` for the keys of
+Rydesta values.
+"""
+
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+# Past this shift, the hashes of two keys are the same: they collide.
+_DEPTH = 64
+
+_MISSING = object()
+
+
+def _hash(key):
+  return hash(key) & ((1 << _DEPTH) - 1)
+
+
+def _index(bitmap, bit):
+  """Where the slot of the bit is among the slots of the bitmap."""
+  return bin(bitmap & (bit - 1)).count('1')
+
+
+class _Node:
+  """An inner node. `bitmap` tells which of the 32 slots are taken, and
+     `slots` are those taken, in order: each is an entry, a (key, value)
+     tuple, or the node of the keys whose hashes share the slot."""
+
+  __slots__ = 'bitmap', 'slots'
+
+  def __init__(self, bitmap, slots):
+    self.bitmap = bitmap
+    self.slots = slots
+
+
+class _Collision:
+  """The entries of the keys whose whole hashes are the same."""
+
+  __slots__ = 'entries',
+
+  def __init__(self, entries):
+    self.entries = entries
+
+
+def _replace(slots, index, slot):
+  return slots[:index] + (slot,) + slots[index + 1:]
+
+
+def _branch(shift, entry, other):
+  """Make the node of two entries whose keys' hashes agree below `shift`."""
+  if shift >= _DEPTH:
+    return _Collision((entry, other))
+  here = (_hash(entry[0]) >> shift) & _MASK
+  there = (_hash(other[0]) >> shift) & _MASK
+  if here == there:
+    return _Node(1 << here, (_branch(shift + _BITS, entry, other),))
+  slots = (entry, other) if here < there else (other, entry)
+  return _Node((1 << here) | (1 << there), slots)
+
+
+def _put(node, shift, hashed, entry):
+  """Return the node with the entry put into it, and whether its key is new."""
+  if type(node) is _Collision:
+    for index, (key, _) in enumerate(node.entries):
+      if key == entry[0]:
+        return _Collision(_replace(node.entries, index, entry)), False
+    return _Collision(node.entries + (entry,)), True
+  bit = 1 << ((hashed >> shift) & _MASK)
+  index = _index(node.bitmap, bit)
+  if not node.bitmap & bit:
+    slots = node.slots[:index] + (entry,) + node.slots[index:]
+    return _Node(node.bitmap | bit, slots), True
+  slot = node.slots[index]
+  if type(slot) is tuple:
+    if slot[0] == entry[0]:
+      return _Node(node.bitmap, _replace(node.slots, index, entry)), False
+    return _Node(node.bitmap, _replace(node.slots, index, _branch(shift + _BITS, slot, entry))), True
+  slot, new = _put(slot, shift + _BITS, hashed, entry)
+  return _Node(node.bitmap, _replace(node.slots, index, slot)), new
+
+
+def _drop(node, shift, hashed, key):
+  """Return the node without the key (None if it is then empty, or the only
+     entry left if that is all there is to it); the node itself if it has
+     no such key."""
+  if type(node) is _Collision:
+    entries = tuple(entry for entry in node.entries if entry[0] != key)
+    if len(entries) == len(node.entries):
+      return node
+    return entries[0] if len(entries) == 1 else _Collision(entries)
+  bit = 1 << ((hashed >> shift) & _MASK)
+  if not node.bitmap & bit:
+    return node
+  index = _index(node.bitmap, bit)
+  slot = node.slots[index]
+  if type(slot) is tuple:
+    if slot[0] != key:
+      return node
+    slot = None
+  else:
+    dropped = _drop(slot, shift + _BITS, hashed, key)
+    if dropped is slot:
+      return node
+    slot = dropped
+  if slot is None:
+    bitmap = node.bitmap & ~bit
+    if not bitmap:
+      return None
+    slots = node.slots[:index] + node.slots[index + 1:]
+    if len(slots) == 1 and type(slots[0]) is tuple and shift:
+      # An entry alone needs no node of its own; the parent takes it.
+      return slots[0]
+    return _Node(bitmap, slots)
+  return _Node(node.bitmap, _replace(node.slots, index, slot))
+
+
+def _entries(node):
+  if type(node) is _Collision:
+    yield from node.entries
+    return
+  for slot in node.slots:
+    if type(slot) is tuple:
+      yield slot
+    else:
+      yield from _entries(slot)
+
+
+class Map:
+  """A persistent map of keys to values. `put` and `drop` return new maps."""
+
+  __slots__ = 'root', 'size'
+
+  def __init__(self, root=None, size=0):
+    self.root = root
+    self.size = size
+
+  def get(self, key, default=None):
+    node, shift, hashed = self.root, 0, _hash(key)
+    while node is not None:
+      if type(node) is _Collision:
+        for other, value in node.entries:
+          if other == key:
+            return value
+        return default
+      bit = 1 << ((hashed >> shift) & _MASK)
+      if not node.bitmap & bit:
+        return default
+      node = node.slots[_index(node.bitmap, bit)]
+      if type(node) is tuple:
+        return node[1] if node[0] == key else default
+      shift += _BITS
+    return default
+
+  def __contains__(self, key):
+    return self.get(key, _MISSING) is not _MISSING
+
+  def put(self, key, value):
+    entry = key, value
+    if self.root is None:
+      return Map(_Node(1 << (_hash(key) & _MASK), (entry,)), 1)
+    root, new = _put(self.root, 0, _hash(key), entry)
+    return Map(root, self.size + new)
+
+  def drop(self, key):
+    if self.root is None:
+      return self
+    root = _drop(self.root, 0, _hash(key), key)
+    if root is self.root:
+      return self
+    return Map(root, self.size - 1)
+
+  def items(self):
+    return () if self.root is None else _entries(self.root)
+
+  def __iter__(self):
+    return (key for key, _ in self.items())
+
+  def __len__(self):
+    return self.size
@@ -1,14 +1,15 @@
-import re
-
 from .error import RyError
-from .reader import RyNode, ReaderError
+from .reader import RyNode, ReaderError, P_Identifier, P_Discard
+from .hamt import Map
 
 from enum import Enum
 from pathlib import Path
-from operator import attrgetter
+from operator import itemgetter
+from itertools import count, zip_longest
 from textwrap import indent, dedent
 from fractions import Fraction
 from linecache import getline
+from copy import copy
 
 
 ###- CLASSES -##############
@@ -54,22 +55,58 @@ class RyTypeType(HasType, _Box):
 
 
 class RyVariations(HasType):
-  """A list of functions with a common name."""
+  """A list of functions with a common name. Besides the list, there is its
+     dispatch table: for every arity, the variations a call of that arity may
+     match, in the order they are to be tried (see `_dispatch`)."""
 
-  __slots__ = 'name', 'variations', 'quoting', 'naked'
+  __slots__ = (
+    'name', 'variations', 'quoting', 'arities', 'slurpy', 'blessed', 'epoch')
 
   type = 'variations'
 
-  def __init__(self, name, initial, quoting=False, naked=False):
+  # How many times a blessing was taken away, from any variations.
+  revocations = 0
+
+  def __init__(self, name, initial, quoting=False):
     self.name = name
-    self.naked = naked
     self.quoting = quoting
-    self.variations = [initial]
+    self.variations = []
+    self.blessed = False
+    self.epoch = 0
+    self.add(initial)
 
   def add(self, variation):
-    """Add a new variation and re-sort the variations by their priority."""
+    """Add a new variation, re-sort the variations by their priority and
+       rebuild the dispatch table."""
     self.variations.append(variation)
     self.variations.sort(key=lambda x: x.priority, reverse=True)
+    # Slurpy variations take any number of arguments, so they are candidates
+    # for every arity; and for the arities no other variation takes, the only.
+    self.slurpy = [x for x in self.variations if x.priority == RyPriority.SLURPY]
+    self.arities = {}
+    for arity in {x.arity for x in self.variations if x.priority != RyPriority.SLURPY}:
+      self.arities[arity] = [x for x in self.variations
+        if x.priority == RyPriority.SLURPY or x.arity == arity]
+    # Blessed are the variations of the type test `'of` that the kernel is sure
+    # of (see `Master.boot`). A variation more, and it's not sure anymore.
+    if self.blessed:
+      RyVariations.revocations += 1
+      self.blessed = False
+    # What the inline caches of call sites know of these variations is only
+    # good for the epoch it was learned in (see `_dispatch`).
+    self.epoch += 1
+
+  def bind(self, state, frame):
+    """Make the same variations, but with the functions that were defined in
+       `frame` seeing `state` instead. They test what these test, and so
+       are as blessed as these are."""
+    first, *rest = [function.bind(state) if function.state.env is frame else function
+      for function in self.variations]
+    variations = RyVariations(self.name, first, self.quoting)
+    for function in rest:
+      variations.add(function)
+    variations.blessed = self.blessed
+    return variations
 
   def __repr__(self):
     return f'[function "{self.name}" with {len(self.variations)} variation(s)]'
@@ -78,17 +115,30 @@ class RyVariations(HasType):
 class RyFunction(HasType):
   """A particular function."""
 
-  __slots__ = 'state', 'priority', 'name', 'params', 'arity', 'body', 'head'
+  __slots__ = 'state', 'priority', 'name', 'params', 'arity', 'body', 'head', 'code', 'checks', 'settled', 'names'
 
   type = 'function'
 
-  def __init__(self, state, priority, name, params, body):
+  def __init__(self, state, priority, name, params, body, code=None):
     self.name = name
     self.body = body
+    self.code = code # the body, compiled by the engine that defined it
     self.state = state
     self.arity = len(params)
     self.params = params
     self.priority = priority
+    self.checks, self.settled = ((), params) if priority == RyPriority.SLURPY else _discriminate(params)
+    # If matching the settled parameters is only binding them, these are the
+    # names to bind the arguments to (None for the arguments discarded).
+    self.names = None
+    if all(param.type in ('P_Identifier', 'P_Discard') for param in self.settled):
+      self.names = [param.name if param.type == 'P_Identifier' else None for param in self.settled]
+
+  def bind(self, state):
+    """Make the same function, but seeing `state` instead."""
+    function = copy(self)
+    function.state = state
+    return function
 
   def _help_rmprefix(self, string, prefix):
     if string.startswith(prefix):
@@ -121,9 +171,12 @@ class RyFunction(HasType):
 
 
 class RyObject(HasType):
-  """A box to enclose the (uninstantiated) objects."""
+  """A box to enclose the (uninstantiated) objects. The functions of the block
+     are the `methods` of the object, defined in a `frame` of their own, and
+     the rest, its `statements`; they are known once it is first instantiated
+     (see `_layout`)."""
 
-  __slots__ = 'name', 'props', 'block', 'state'
+  __slots__ = 'name', 'props', 'block', 'state', 'methods', 'frame', 'statements'
 
   type = 'object'
 
@@ -132,6 +185,7 @@ class RyObject(HasType):
     self.props = props
     self.block = block
     self.state = state
+    self.methods = self.frame = self.statements = None
 
   def __repr__(self):
     return f'[object {self.name}]'
@@ -158,7 +212,7 @@ class RyExcerpt(HasType):
   type = 'excerpt'
 
   def __init__(self, state, node):
-    # Excerpts are somewhat-ly closures, too.
+    # Excerpts are somewhat-ly closures, too: they see the frame they were made in.
     self.state = state.copy()
     self.node = node
 
@@ -190,19 +244,138 @@ class RyBool(HasType, _Box):
 
 
 class RyVec(HasType, _Box):
+  """A box for a Rydesta vector, whose value is a list (or, if the vector
+     is a constant, see `_constant`, a tuple; or a _Slice, if it is a part
+     of another vector, or was joined with one). Neither is ever changed
+     once boxed."""
+
   type = 'vec'
 
   def __repr__(self):
     return f'[{" ".join(str(item) for item in self.value)}]'
 
 
+class RyDict(HasType, _Box):
+  """A box for a Rydesta dict, whose value is a persistent hamt.Map of the
+     keys of its keys (see `_key`) to (key, value, order) triples, `order`
+     being when the key was first put (see `_put`). Putting a key into a
+     dict or dropping one from it makes a new dict, which shares most of
+     the map with the old one."""
+
+  type = 'dict'
+
+  def __repr__(self):
+    if not self.value:
+      return '[=>]'
+    return f'[{" ".join(f"{key} => {value}" for key, value in _entries(self.value))}]'
+
+
+class RySeq(HasType, _Box):
+  """A box for a lazy Rydesta sequence, whose value is the _Lazy cell of its
+     first item. Items are pulled one at a time, when first needed, and are
+     the same every time after; so a seq never changes either."""
+
+  type = 'seq'
+
+  # How many items of a seq its __repr__ shows (and so pulls).
+  SHOWN = 8
+
+  def __repr__(self):
+    items = []
+    for item in _items(self):
+      if len(items) == RySeq.SHOWN:
+        items.append('...')
+        break
+      items.append(str(item))
+    return f'[seq{"".join(f" {item}" for item in items)}]'
+
+
+class _Lazy:
+  """A cell of a lazy sequence: its `item`, and the cell of the rest, both
+     pulled out of `source`, a Python iterator of Rydesta values, the first
+     time `pull` is called. The cells of a source are pulled in order, as
+     each is made only once the one before it was pulled."""
+
+  __slots__ = 'source', 'item', 'rest'
+
+  def __init__(self, source):
+    self.source = source
+    self.item = self.rest = None
+
+  def pull(self):
+    """Return whether the cell has an item (and so, a rest)."""
+    if self.source is not None:
+      source, self.source = self.source, None
+      for item in source:
+        self.item, self.rest = item, _Lazy(source)
+        break
+    return self.rest is not None
+
+
+class _Buffer:
+  """The items _Slices are views of. A buffer grows at both ends, but never
+     changes the items it has: `front` holds, reversed, those before index 0,
+     and `back` the others. The `back` of a buffer made out of a vector's
+     list or tuple is that list or tuple, which the buffer must not grow;
+     then, `owned` is False."""
+
+  __slots__ = 'front', 'back', 'owned'
+
+  def __init__(self, back, owned):
+    self.front = []
+    self.back = back
+    self.owned = owned
+
+
+class _Slice:
+  """A read-only sequence of the items of a buffer from `start` to `stop`.
+     Slicing one is a view of the same buffer. Items the slices of a buffer
+     do not see may be added at its ends; see `_join`."""
+
+  __slots__ = 'buffer', 'start', 'stop'
+
+  def __init__(self, buffer, start, stop):
+    self.buffer = buffer
+    self.start = start
+    self.stop = stop
+
+  def __len__(self):
+    return self.stop - self.start
+
+  def __iter__(self):
+    front, back = self.buffer.front, self.buffer.back
+    for index in range(self.start, min(self.stop, 0)):
+      yield front[~index]
+    for index in range(max(self.start, 0), self.stop):
+      yield back[index]
+
+  def __getitem__(self, index):
+    if type(index) is slice:
+      start, stop, step = index.indices(self.stop - self.start)
+      if step != 1:
+        return tuple(self)[index]
+      # An empty vector is an empty tuple, for everything to know it is.
+      return () if start >= stop else _Slice(self.buffer, self.start + start, self.start + stop)
+    if index < 0:
+      index += self.stop - self.start
+    if not 0 <= index < self.stop - self.start:
+      raise IndexError('vector index out of range')
+    index += self.start
+    return self.buffer.back[index] if index >= 0 else self.buffer.front[~index]
+
+
 class RyNum(HasType, _Box):
-  """A box for a Rydesta number. The value passed to the initializer
-     must be a Fraction; otherwise, everything will break apart."""
+  """A box for a Rydesta number. The value passed to the initializer must
+     be an int while the number is integral, and a Fraction (or, if the
+     master computes with floats, a float) when it is not; see `_normal`."""
 
   type = 'num'
 
   def __repr__(self):
+    if type(self.value) is int:
+      return str(self.value)
+    elif type(self.value) is float:
+      return str(int(self.value) if self.value.is_integer() else self.value)
     value = self.value.numerator
     try:
       value /= self.value.denominator
@@ -219,20 +392,119 @@ class RyStr(HasType, _Box):
     return f'"{self.value}"'
 
 
+class RyEnv(dict):
+  """A frame of variables. A variable not found in the frame is looked up in
+     its parent frame (and so on), but is always defined in the frame itself.
+     `keys`, `items` and the like only see the variables of the frame."""
+
+  __slots__ = 'parent',
+
+  def __init__(self, parent=None):
+    self.parent = parent
+
+  def __missing__(self, name):
+    if self.parent is None:
+      raise KeyError(name)
+    return self.parent[name]
+
+  def __contains__(self, name):
+    return dict.__contains__(self, name) or self.parent is not None and name in self.parent
+
+  def get(self, name, default=None):
+    try:
+      return self[name]
+    except KeyError:
+      return default
+
+
+class _Members(RyEnv):
+  """The frame of an instance of `obj`: its properties, and what the block of
+     the object binds but the methods. Those are shared by all instances of
+     the object, and bound to the instance when it first asks for them."""
+
+  __slots__ = 'obj',
+
+  def __init__(self, obj):
+    super().__init__(obj.state.env)
+    self.obj = obj
+
+  def __missing__(self, name):
+    methods = self.obj.methods.get(name)
+    if methods is None:
+      return super().__missing__(name)
+    state = self.obj.state.copy()
+    state.env = self
+    self[name] = methods = methods.bind(state, self.obj.frame)
+    return methods
+
+  def __contains__(self, name):
+    return name in self.obj.methods or super().__contains__(name)
+
+
+class _Overlay(RyEnv):
+  """A frame for one master to see the frame of the booted image, or of a
+     module, through; `state` is the state of the master that frame is the
+     frame of. The variations among the `exports` of that frame (all it
+     defines, unless told otherwise) are bound to the overlay the first
+     time they are asked for: their functions see the overlay instead, and
+     so the variations the master adds to, while every other master sees
+     its own."""
+
+  __slots__ = 'state', 'exports'
+
+  def __init__(self, state, exports=None):
+    super().__init__(state.env)
+    self.state = state.copy()
+    self.state.env = self
+    self.exports = state.env if exports is None else exports
+
+  def __missing__(self, name):
+    value = dict.get(self.exports, name)
+    if value is None:
+      return self.parent[name]
+    elif isinstance(value, RyVariations):
+      self[name] = value = value.bind(self.state, self.parent)
+    return value
+
+
+class _Public(RyEnv):
+  """A frame that lets through what its parent frame has, but the private
+     names: the frame a master sees the booted image through."""
+
+  __slots__ = ()
+
+  def __missing__(self, name):
+    if name.startswith('_'):
+      raise KeyError(name)
+    return self.parent[name]
+
+  def __contains__(self, name):
+    return not name.startswith('_') and name in self.parent
+
+
 class RyState:
-  """A vehicle to carry values on an inter-node highway."""
+  """A vehicle to carry values on an inter-node highway. `evaluate` is the
+     engine nodes are evaluated with, `_visit_node` unless told otherwise."""
 
-  __slots__ = 'filename', 'reader', 'line', 'env'
+  __slots__ = 'filename', 'reader', 'line', 'env', 'master', 'evaluate'
 
-  def __init__(self, filename, reader, env={}, line=1):
+  def __init__(self, filename, reader, env=None, line=1, master=None, evaluate=None):
     self.filename = filename
     self.reader = reader
     self.line = line
-    self.env = env
+    self.env = RyEnv() if env is None else env
+    self.master = master
+    self.evaluate = evaluate or _visit_node
 
   def copy(self):
-    """Make a copy of the state."""
-    return RyState(self.filename, self.reader, self.env.copy(), self.line)
+    """Make a copy of the state. The frame is not copied, but shared."""
+    return RyState(
+      self.filename, self.reader, self.env, self.line, self.master, self.evaluate)
+
+  def child(self):
+    """Make a state with a new frame, whose parent is the frame of this one."""
+    return RyState(
+      self.filename, self.reader, RyEnv(self.env), self.line, self.master, self.evaluate)
 
   def __repr__(self):
     return f'[frozen state for "{self.filename}"]'
@@ -281,6 +553,8 @@ def _prioritize(pattern):
     return sum(map(_prioritize, pattern.fields), RyPriority.EXTRACT) * (len(pattern.fields) + 1)
   elif pattern.type == 'P_Unpack':
     return sum(map(_prioritize, pattern.members), RyPriority.UNPACK) * (len(pattern.members) + 1)
+  elif pattern.type == 'P_DictExtract':
+    return sum(map(_prioritize, pattern.fields), RyPriority.UNPACK) * (len(pattern.fields) + 1)
   elif pattern.type in ('P_Identifier', 'P_Discard'):
     return RyPriority.IDENTIFIER
   elif pattern.type in ('P_NamedMulti', 'P_NamedMany'):
@@ -291,6 +565,88 @@ def _prioritize(pattern):
     return RyPriority.UNREACHABLE
 
 
+def _binds(pattern):
+  """Return the set of names the pattern may bind."""
+  if type(pattern) is list:
+    return set().union(*map(_binds, pattern))
+  elif pattern.type in ('P_Identifier', 'P_NamedMulti', 'P_NamedMany'):
+    return {pattern.name}
+  elif pattern.type == 'P_Guard':
+    return {pattern.param}
+  elif pattern.type == 'P_Extract':
+    return _binds(pattern.fields)
+  elif pattern.type == 'P_Unpack':
+    return _binds(pattern.members)
+  elif pattern.type == 'P_DictExtract':
+    return _binds(pattern.fields)
+  return set()
+
+
+def _discriminate(params):
+  """Given the parameters of a function, return a list of (index, check, typed)
+     triples and the list of settled parameters. `check(arg, env)` is a cheap
+     test of the parameter at `index` against `arg` (`env` being the function's):
+     it is False if the parameter cannot match, True if what's left to match
+     is the settled parameter, and None if it's the parameter itself. `typed`
+     is, for the checks that look at nothing but the type of `arg`, the name
+     of the type they look up (and None for the other checks). The checks
+     come from literal comparisons, `(x of T)` guards, and unpack shapes; the
+     other parameters are left to the pattern engine."""
+  checks, settled = [], [*params]
+  bound = _binds(params)
+  for index, param in enumerate(params):
+    if param.type == 'P_Compare' and _constant(param.value) is not None:
+      checks.append((index, _compare_check(_constant(param.value)), None))
+      settled[index] = P_Discard(param.line)
+    elif param.type == 'P_Guard':
+      guard = param.guard
+      # The guard must be just `param of T`, neither `'of` nor T being names
+      # the params bind.
+      if guard.type == 'Call' and guard.callee.type == 'Request' \
+          and guard.callee.name == "'of" and "'of" not in bound and len(guard.args) == 2 \
+          and guard.args[0].type == 'Request' and guard.args[0].name == param.param \
+          and guard.args[1].type == 'Request' and guard.args[1].name not in bound:
+        checks.append((index, _type_check(guard.args[1].name), guard.args[1].name))
+        settled[index] = P_Identifier(param.line, name=param.param)
+    elif param.type == 'P_Unpack':
+      members = [member.type for member in param.members]
+      multis = sum(member in ('P_DiscardMulti', 'P_NamedMulti') for member in members)
+      manys = sum(member in ('P_DiscardMany', 'P_NamedMany') for member in members)
+      # Leave several groups to the pattern engine, who knows what's right.
+      if multis + manys < 2:
+        checks.append((index, _shape_check(len(members) - manys, exact=not (multis or manys)), None))
+  return checks, settled
+
+
+def _compare_check(value):
+  def check(arg, env):
+    return _equals(value, arg)
+  return check
+
+
+def _type_check(name):
+  def check(arg, env):
+    # This is what `'of` does, but only the blessed `'of` is sure to. The
+    # type name is as well looked up by the guard, and need not be a type.
+    test, T = env.get("'of"), env.get(name)
+    if isinstance(test, RyVariations) and test.blessed and isinstance(T, RyTypeType) \
+        and isinstance(arg, HasType):
+      return arg.type == T.value
+    return None
+  return check
+
+
+def _shape_check(length, exact):
+  def check(arg, env):
+    if isinstance(arg, RySeq):
+      # How long a seq is, is only known once it is pulled; let the pattern do that.
+      return None
+    elif not isinstance(arg, (RyVec, RyStr)):
+      return False
+    return len(arg.value) == length if exact else len(arg.value) >= length
+  return check
+
+
 ###- INTERPRETER -##############
 ### Equality ####################
 
@@ -301,16 +657,156 @@ def _equals(left, right):
     if isinstance(left, RyBool) or isinstance(right, RyBool):
       if lval is rval:
         return True
+    elif isinstance(left, RySeq) or isinstance(right, RySeq):
+      # Seqs are equal to the vecs (and seqs) of the same items; they are
+      # pulled only until the first that differs.
+      if isinstance(left, (RyVec, RySeq)) and isinstance(right, (RyVec, RySeq)):
+        end = object()
+        return all(litem is not end and ritem is not end and _equals(litem, ritem)
+          for litem, ritem in zip_longest(_items(left), _items(right), fillvalue=end))
+      return False
     elif isinstance(left, RyVec) and isinstance(right, RyVec):
       if len(lval) == len(rval):
         return all(_equals(litem, ritem) for litem, ritem in zip(lval, rval))
       return False
-    elif lval in ('', []) and rval in ('', []) or lval == rval:
+    elif isinstance(left, RyDict) and isinstance(right, RyDict):
+      if len(lval) == len(rval):
+        return all(key in rval and _equals(entry[1], rval.get(key)[1])
+          for key, entry in lval.items())
+      return False
+    elif lval in ('', [], ()) and rval in ('', [], ()) or lval == rval:
       return True
   return False
 
+
+def _key(value):
+  """Return a key for the value, such that the keys of two values are equal
+     exactly when `_equals` finds the values equal; or None if there is none."""
+  # Like `_equals`, strings and types are equal if their names are, and empty
+  # strings and vectors are all equal.
+  if isinstance(value, RyBool):
+    return RyBool, value.value
+  elif isinstance(value, RyNum):
+    # NaN (there is in float mode) equals nothing, itself included.
+    return None if value.value != value.value else (RyNum, value.value)
+  elif isinstance(value, (RyStr, RyTypeType)):
+    return value.value
+  elif isinstance(value, RyVec):
+    if not value.value:
+      return ''
+    keys = tuple(map(_key, value.value))
+    return None if None in keys else (RyVec, keys)
+  return None
+
+### Vectors ##############
+
+def _view(items):
+  """Return the items of a vector as a _Slice."""
+  return items if type(items) is _Slice else _Slice(_Buffer(items, False), 0, len(items))
+
+
+def _join(left, right):
+  """Join the items of two vectors. Where it can, this adds the fewer items
+     to the buffer of the others: the left ones in front of the right ones,
+     if those are at the start of their buffer, or the right ones after the
+     left ones, if those are at its end. Otherwise, both are copied into a
+     new buffer. Either way, no vector sees the change."""
+  if not left:
+    return right
+  elif not right:
+    return left
+  left, right = _view(left), _view(right)
+  front = right.start == -len(right.buffer.front)
+  if left.stop == len(left.buffer.back) and (not front or len(right) <= len(left)):
+    buffer = left.buffer
+    if not buffer.owned:
+      # The list (or tuple) is a vector's own; the buffer grows a copy.
+      buffer.back, buffer.owned = [*buffer.back], True
+    buffer.back.extend(right)
+    return _Slice(buffer, left.start, left.stop + len(right))
+  elif front:
+    buffer = right.buffer
+    buffer.front.extend(reversed(left))
+    return _Slice(buffer, right.start - len(left), right.stop)
+  items = [*left, *right]
+  return _Slice(_Buffer(items, True), 0, len(items))
+
+### Sequences ##############
+
+def _items(value):
+  """Iterate over the items of a vec or a seq (pulling those of a seq as
+     they are needed)."""
+  if isinstance(value, RyVec):
+    yield from value.value
+    return
+  cell = value.value
+  while cell.pull():
+    yield cell.item
+    cell = cell.rest
+
+
+def _from_py(value):
+  """Make a Python value a Rydesta one, if it has a box of its own."""
+  if isinstance(value, HasType):
+    return value
+  elif type(value) is bool:
+    return RyBool(value)
+  elif type(value) in (int, Fraction, float):
+    return RyNum(_normal(value))
+  elif type(value) is str:
+    return RyStr(value)
+  return value
+
+
+def _pythonic(S, iterable):
+  """Iterate over a Python iterable, making its values Rydesta ones. If it
+     fails, die, although that may be when a seq is unpacked long after."""
+  try:
+    for value in iterable:
+      yield _from_py(value)
+  except Exception as error:
+    _die(S, f'python exception: {error}')
+
+
+def _visit_seq(S, pattern, value):
+  """Match the P_Unpack pattern against a seq. Its items are pulled one at a
+     time, for a member each; a group may only be the last member, and is
+     given the (lazy) rest."""
+  cell = value.value
+  for index, member in enumerate(pattern.members):
+    if member.type in ('P_DiscardMulti', 'P_NamedMulti', 'P_DiscardMany', 'P_NamedMany'):
+      named, multi = 'Named' in member.type, 'Multi' in member.type
+      name = member.name if named else f'<{"plus" if multi else "star"}>'
+      if index != len(pattern.members) - 1:
+        return False, f'"{name}" is not the last of the pattern, but a seq is unpacked from its start'
+      elif multi and not cell.pull():
+        return False, f'"{name}" required at least one item to match, got none: {value}'
+      if named:
+        S.env[member.name] = RySeq(cell)
+      return True, ''
+    if not cell.pull():
+      return False, f'got pattern of length {len(pattern.members)}, but the seq is of length {index}'
+    status, payload = _visit_pattern(S, member, cell.item)
+    if not status:
+      return False, f'unpack failed on member no. {index + 1}; {payload}'
+    cell = cell.rest
+  if cell.pull():
+    return False, f'got pattern of length {len(pattern.members)}, but the seq is longer: {value}'
+  return True, ''
+
 ### Pattern Engine ##############
 
+def _separator(pattern):
+  """If the P_Compare pattern compares to a constant, non-empty string,
+     return that string; otherwise, None."""
+  try:
+    return pattern.separator
+  except AttributeError:
+    value = _constant(pattern.value)
+    pattern.separator = value.value if isinstance(value, RyStr) and value.value else None
+    return pattern.separator
+
+
 def _visit_pattern(S, pattern, value):
   """Given a pattern and a value for it to try to match on, return a tuple of
      (status, payload), where, if status is False, payload is an error message;
@@ -318,12 +814,12 @@ def _visit_pattern(S, pattern, value):
   if pattern.type == 'P_Identifier':
     S.env[pattern.name] = value
   elif pattern.type == 'P_Compare':
-    comparee = _visit_node(S, pattern.value)
+    comparee = S.evaluate(S, pattern.value)
     if not _equals(comparee, value):
       return False, f'expected {comparee}, found {value}'
   elif pattern.type == 'P_Guard':
     S.env[pattern.param] = value
-    result = _visit_node(S, pattern.guard)
+    result = S.evaluate(S, pattern.guard)
     if not (isinstance(result, RyBool) and result.value):
       return False, f'vetoed by the guard of "{pattern.param}"'
   elif pattern.type == 'P_Extract':
@@ -342,11 +838,26 @@ def _visit_pattern(S, pattern, value):
       status, payload = _visit_pattern(S, field, extractable)
       if not status:
         return False, f'extraction for "{obj.name}" failed on field for "{prop}": {payload}'
+  elif pattern.type == 'P_DictExtract':
+    if not isinstance(value, RyDict):
+      return False, f'right-hand side must be a dict, got {value}'
+    for key, field in zip(pattern.keys, pattern.fields):
+      key = S.evaluate(S, key)
+      entry = value.value.get(_key(key))
+      if entry is None:
+        return False, f'no key {key} in {value}'
+      status, payload = _visit_pattern(S, field, entry[1])
+      if not status:
+        return False, f'extraction for key {key} failed: {payload}'
+  elif pattern.type == 'P_Unpack' and isinstance(value, RySeq):
+    return _visit_seq(S, pattern, value)
   elif pattern.type == 'P_Unpack':
     if not isinstance(value, (RyVec, RyStr)):
       return False, f'right-hand side must be a vector or a string, got {value}'
-    # If the value is string, return substrings. If vector, return sub-vectors.
+    # If the value is string, return substrings. If vector, return sub-vectors,
+    # which are views of the vector's items.
     is_str = isinstance(value, RyStr)
+    items = value.value if is_str else _view(value.value)
     myself = 'string' if is_str else 'vector'
     multis = len(_just_of(pattern.members, 'P_DiscardMulti', 'P_NamedMulti'))
     manys = len(_just_of(pattern.members, 'P_DiscardMany', 'P_NamedMany'))
@@ -362,37 +873,53 @@ def _visit_pattern(S, pattern, value):
       if not members:
         break
       member = pattern.members[m_off]
-      values = value.value[v_off:]
       named, multi = 'Named' in member.type, 'Multi' in member.type
       name = member.name if named else f'<{"plus" if multi else "star"}>'
       # Assume we'll capture everything up to the vector's end.
-      captured = len(values) - len(members[1:])
+      captured = len(items) - v_off - len(members[1:])
       if member.type.startswith(('P_DiscardM', 'P_NamedM')):
+        # What is captured starts here; the items are not copied until then.
+        start = v_off
         # Detect a separator (which has to directly follow the grouping).
         # Valid separators are patterns that capture exactly one value: comparison,
         # object extraction, or a guarding expression.
         if len(members) > 1 and members[1].type in ('P_Compare', 'P_Guard', 'P_Extract'):
-          # Iterate over the values left until we meet the specified separator.
-          for index, item in enumerate(values):
-            status, _ = _visit_pattern(S, members[1], RyStr(item) if is_str else item)
-            if status is True:
-              captured = index
-              # For v_off, we jump over the delimiter ('consuming' it).
-              # For m_off, we jump over the pattern of the delimiter.
-              v_off += 1
+          separator = is_str and members[1].type == 'P_Compare' and _separator(members[1])
+          if separator:
+            # A constant string separates strings wherever it is found, which
+            # Python does best; then, it may be longer than one character.
+            index = items.find(separator, start)
+            if index != -1:
+              captured = index - start
+              v_off += len(separator)
               m_off += 1
-              break
-            elif index == len(values) - 1:
+            elif start < len(items):
               return False, f'reached the end of the {myself} searching for the delimiter of "{name}": {value}'
-        if not captured and multi:
+          else:
+            # Iterate over the values left until we meet the specified separator.
+            for index in range(start, len(items)):
+              item = items[index]
+              status, _ = _visit_pattern(S, members[1], RyStr(item) if is_str else item)
+              if status is True:
+                captured = index - start
+                # For v_off, we jump over the delimiter ('consuming' it).
+                # For m_off, we jump over the pattern of the delimiter.
+                v_off += 1
+                m_off += 1
+                break
+              elif index == len(items) - 1:
+                return False, f'reached the end of the {myself} searching for the delimiter of "{name}": {value}'
+        if captured < 0:
+          return False, f'the given {myself} is too small to be captured by {name}'
+        elif not captured and multi:
           return False, f'"{name}" required at least one item to match, got none: {value}'
         if named:
-          S.env[member.name] = (RyStr if is_str else RyVec)(values[:captured])
+          S.env[member.name] = (RyStr if is_str else RyVec)(items[start:start + captured])
         v_off += captured
       elif captured < 0:
         return False, f'the given {myself} is too small to be captured by {name}'
       else: # if it's not DiscardM... or NamedM...
-        item = value.value[v_off]
+        item = items[v_off]
         status, payload = _visit_pattern(S, member, RyStr(item) if is_str else item)
         if not status:
           return False, f'unpack failed on member no. {m_off + 1}, for item no. {v_off + 1}; {payload}'
@@ -403,11 +930,494 @@ def _visit_pattern(S, pattern, value):
   return True, ''
 
 
+### Evaluation helpers ##############
+# What follows is shared by the engines: `_visit_node` below, and the
+# compiling ones found in other modules.
+
+def _sort_cases(node):
+  """Sort the cases of a Cases node in the order they are to be tried."""
+  node.cases.sort(
+    # ValueCases have priority over MatchCases.
+    key=lambda x: 2**32 if x.type == 'ValueCase' else _prioritize(x.cond),
+    reverse=True)
+
+
+class _CaseTable:
+  """A run of ValueCases whose conditions are constant literals or names, which
+     picks the case equal to a value by its key (see `_key`) rather than trying
+     the cases one by one. The names are looked up every time, but the table is
+     made anew only when what they are bound to changes."""
+
+  __slots__ = 'cases', 'names', 'bound', 'keys'
+
+  def __init__(self, cases):
+    self.cases = cases
+    self.names = [case.cond.name for case in cases if case.cond.type == 'Request']
+    self.bound = None
+    self.keys = None
+
+  def pick(self, S, value):
+    """Return the first of the cases whose condition equals the value, or None
+       if none does."""
+    try:
+      bound = [S.env[name] for name in self.names]
+    except KeyError:
+      return self._scan(S, value)
+    if self.bound is None or any(x is not y for x, y in zip(bound, self.bound)):
+      self._make(bound)
+    key = _key(value)
+    if self.keys is None or key is None:
+      return self._scan(S, value)
+    return self.keys.get(key)
+
+  def _make(self, bound):
+    self.bound, self.keys = bound, {}
+    bound = iter(bound)
+    for case in self.cases:
+      key = _key(next(bound) if case.cond.type == 'Request' else _constant(case.cond))
+      if key is None:
+        self.keys = None
+        return
+      self.keys.setdefault(key, case)
+
+  def _scan(self, S, value):
+    """Try the cases one by one, as if there were no table."""
+    for case in self.cases:
+      if _equals(S.evaluate(S, case.cond), value):
+        return case
+    return None
+
+
+def _plan_cases(node):
+  """Return the arms of a Cases node, in the order they are to be tried: the
+     cases themselves, with the runs of ValueCases whose conditions are
+     constant literals or names made into _CaseTables. They are planned once,
+     and kept in the node."""
+  try:
+    return node.plan
+  except AttributeError:
+    _sort_cases(node)
+    plan, run = [], []
+    for case in [*node.cases, None]:
+      if case is not None and case.type == 'ValueCase' \
+          and (case.cond.type == 'Request' or _constant(case.cond) is not None):
+        run.append(case)
+        continue
+      # One case is no table.
+      plan += [_CaseTable(run)] if len(run) > 1 else run
+      run = []
+      if case is not None:
+        plan.append(case)
+    node.plan = plan
+    return plan
+
+
+def _define(S, node, code=None):
+  """Make a function out of the Function `node`, and add it to the variations
+     of the same name (making them first, if there are none). Return those."""
+  function = RyFunction(S,
+    RyPriority.SLURPY if node.slurpy else _prioritize(node.params),
+    node.name, node.params, node.body, code)
+  variations = S.env.get(node.name, False)
+  if node.name.startswith('\'') and function.arity not in (1, 2):
+    _die(S,
+      'expected either a prefix (arity = 1) or infix (arity = 2), ' \
+      f'got arity = {function.arity}')
+  # If the function exists, make this one one of its variations.
+  if isinstance(variations, RyVariations):
+    if variations.quoting != node.quoting:
+      _die(S, f'expected variation `{function}` to be quoting')
+    variations.add(function)
+  else:
+    S.env[node.name] = variations = RyVariations(
+      node.name, function,
+      quoting = node.quoting)
+  return variations
+
+
+def _define_object(S, node):
+  S.env[node.name] = (RySecretObject if node.secret else RyObject)(
+    node.name,
+    node.properties,
+    node.block,
+    S.copy())
+  return RyNothing()
+
+
+def _needs(S, node):
+  """Bring what the module the Needs `node` asks for exports into `S`, and the
+     grammar it leaves. The module is evaluated unless the registry of modules
+     has it already (see Registry). The master of `S` sees the module through
+     an overlay of its own, so the module sees the variations the master adds
+     to what it exports, and no other master does."""
+  master = S.master
+  registry = master.registry
+  filename = f'{"_" if node.hidden else ""}{node.module}.ry'
+  path = registry.resolve(S.env['PATH'].value, filename, master.reload)
+  if path is None:
+    _die(S, f'%smodule not found: "{node.module}"' % ('hidden ' if node.hidden else ''))
+  module = registry.get(path, master.reload)
+  if module is None:
+    if path in registry.loading:
+      _die(S, f'module "{node.module}" needs itself, through the modules it needs')
+    registry.loading.add(path)
+    try:
+      mtime = path.stat().st_mtime_ns
+      spawned = master.spawn(path)
+      spawned.feed_file(path)
+      module = registry.add(path, spawned.state, spawned.exports(), spawned.reader.switches, mtime)
+    finally:
+      registry.loading.discard(path)
+  S.reader.switches = S.reader.switches.merged(module.switches)
+  S.env['MODULE-CACHE'].value.add(RyStr(str(path)))
+  overlay = master.overlays.get(module)
+  if overlay is None:
+    master.overlays[module] = overlay = _Overlay(module.state, module.exports)
+  exports = {name: overlay[name] for name in module.exports}
+  if node.expose:
+    S.env.update(exports)
+  else:
+    name = node.module.split('/')[-1].capitalize()
+    S.env[name] = RyRouteable(node.module, exports)
+  return RyNothing()
+
+
+def _unquote(S, quoted):
+  """Evaluate an excerpt in a new frame, a child of the one it was excerpted in."""
+  if not isinstance(quoted, RyExcerpt):
+    _die(S, f'cannot unquote a non-excerpt value: {quoted}')
+  state = quoted.state.child()
+  return state.evaluate(state, quoted.node)
+
+
+def _convert(S, callee, arg):
+  """Apply a type-like function, Rydesta's sole type-casting mechanism:
+       num "12.34" -> 12
+       str 12.34 -> "12.34"
+       vec "hello!" -> ["h" "e" "l" "l" "o" "!"]
+       vec ["a" => 1] -> [["a" 1]]
+       vec (1 to 3) -> [1 2 3]
+       dict [["a" 1]] -> ["a" => 1]
+       seq [1 2 3] -> (a seq of 1, 2, 3)"""
+  if callee.value == 'num':
+    if isinstance(arg, RyStr): # num "12.34" ==> 12.34
+      try:
+        return RyNum(_normal(Fraction(arg.value)))
+      except ValueError as error:
+        _die(S, f'was not able to convert to num: {arg}')
+  elif callee.value == 'str':
+    if isinstance(arg, RyNum): # str 12.34 ==> "12.34"
+      return RyStr(repr(arg))
+  elif callee.value == 'vec':
+    if isinstance(arg, RyStr): # vec "hello" ==> ["h" "e" "l" "l" "o"]
+      return RyVec([RyStr(ch) for ch in arg.value])
+    elif isinstance(arg, RyDict): # vec ["a" => 1] ==> [["a" 1]]
+      return RyVec([RyVec(entry) for entry in _entries(arg.value)])
+    elif isinstance(arg, RySeq): # vec (1 to 3) ==> [1 2 3]
+      return RyVec([*_items(arg)])
+  elif callee.value == 'seq':
+    if isinstance(arg, RyVec): # seq [1 2 3] ==> (a seq of 1, 2, 3)
+      return RySeq(_Lazy(iter(arg.value)))
+    elif isinstance(arg, RyStr): # seq "ab" ==> (a seq of "a", "b")
+      return RySeq(_Lazy(map(RyStr, arg.value)))
+    elif isinstance(arg, RySeq):
+      return arg
+  elif callee.value == 'dict':
+    if isinstance(arg, RyVec): # dict [["a" 1]] ==> ["a" => 1]
+      for pair in arg.value:
+        if not isinstance(pair, RyVec) or len(pair.value) != 2:
+          _die(S, f'was not able to convert to dict: {pair} is not a [key value] pair')
+      return _dict(S, [pair.value for pair in arg.value])
+  elif callee.value == 'type':
+    # A nice way to get an entity's type!
+    return RyTypeType(arg.type)
+  _die(S, f'no special-form "{callee.value}" to convert {arg} to {callee})')
+
+
+def _check(variation, args, checks):
+  """Run the given cheap checks of the variation on the `args`. Return the
+     parameters left to match if the variation may match; otherwise, False if
+     the types of the `args` alone ruled it out, and None if anything else did."""
+  # A variation whose cheap checks fail cannot match, so we skip it without
+  # making a capsule, or running the pattern engine. If the checks are sure
+  # of themselves, the pattern engine is left with the settled parameters.
+  env, params = variation.state.env, variation.settled
+  for index, check, typed in checks:
+    verdict = check(args[index], env)
+    if verdict is False:
+      return False if typed else None
+    elif verdict is None:
+      params = variation.params
+  return params
+
+
+def _bind(variation, params, args):
+  """Match the `args` against the `params` of the variation, in a new capsule
+     (the state to evaluate its body in). Return the capsule, or None if they
+     do not match."""
+  capsule = variation.state.child()
+  if variation.priority == RyPriority.SLURPY:
+    params, args = variation.params, [RyVec(args)]
+  elif params is variation.settled and variation.names is not None:
+    env = capsule.env
+    for name, arg in zip(variation.names, args):
+      if name is not None:
+        env[name] = arg
+    return capsule
+  for param, arg in zip(params, args):
+    if not _visit_pattern(capsule, param, arg)[0]:
+      return None
+  return capsule
+
+
+def _witnesses(variations):
+  """Return (env, name, value) triples for the `'of` and the types the type
+     checks of the `variations` look up, `value` being what `name` is in the
+     `env` of the variation now."""
+  witnesses = {}
+  for variation in variations:
+    env = variation.state.env
+    for _, _, typed in variation.checks:
+      if typed is not None:
+        for name in ("'of", typed):
+          witnesses[id(env), name] = env, name, env.get(name)
+  return [*witnesses.values()]
+
+
+# Hits and misses of the inline caches of call sites, since the start.
+SITE_STATS = {'hits': 0, 'misses': 0}
+
+# How many entries an inline cache may have before it starts anew.
+_POLYMORPHISM = 4
+
+
+def _dispatch(S, callee, args, site):
+  """Find the variation of `callee` the `args` match, and return it together
+     with the capsule (the state) to evaluate its body in. `site` is the Call
+     node that makes the call."""
+  # The algorithm works as follows: we iterate through the variations that
+  # take this many arguments, which are already sorted by priority, and try
+  # to apply the `args`.
+  # + On success we make the variation's capsule and dive into it.
+  # + On failure, which means getting to the last variation and not matching,
+  #   we err and give a briefing on all the variations there are.
+  # What the type checks say depends on nothing but the types of the `args`.
+  # So the call site remembers the variation that matched, if all it took to
+  # rule out the ones before it, and to let it through, were type checks: for
+  # `args` of the same types, it is the one to try first, and only its checks
+  # that look at more than types are to be made again. The inline cache is
+  # keyed by the callee, the epochs of the callee and of the blessings the
+  # type checks rely on, and the types. The `'of` and the types the checks
+  # looked up may be shadowed or rebound since, so the entry remembers what
+  # they were, and is only trusted while they still are.
+  cache = getattr(site, 'cache', None)
+  if cache is not None:
+    entry = cache.get((callee, callee.epoch, RyVariations.revocations, *map(type, args)))
+    if entry is not None:
+      variation, checks, witnesses = entry
+      params = _check(variation, args, checks) if checks else variation.settled
+      if params is not None and params is not False \
+          and all(env.get(name) is value for env, name, value in witnesses):
+        capsule = _bind(variation, params, args)
+        if capsule is not None:
+          SITE_STATS['hits'] += 1
+          return variation, capsule
+  SITE_STATS['misses'] += 1
+  typed = True
+  variations = callee.arities.get(len(args), callee.slurpy)
+  for tried, variation in enumerate(variations, 1):
+    params = _check(variation, args, variation.checks)
+    if params is False:
+      continue
+    capsule = None if params is None else _bind(variation, params, args)
+    if capsule is not None:
+      if typed and params is variation.settled:
+        if cache is None:
+          site.cache = cache = {}
+        elif len(cache) == _POLYMORPHISM:
+          cache.clear()
+        key = (callee, callee.epoch, RyVariations.revocations, *map(type, args))
+        checks = [check for check in variation.checks if check[2] is None]
+        cache[key] = variation, checks, _witnesses(variations[:tried])
+      return variation, capsule
+    typed = False
+  # Not one of the variations matched. Dump all available.
+  variations = '\n'.join(x.dump() for x in callee.variations)
+  _die(S,
+    f'of these variations:\n{indent(variations, " " * 2)}\n' \
+    f'none matched the {len(args)} argument(s) given: {", ".join(map(repr, args))}')
+
+
+def _call_builtin(S, callee, args):
+  try:
+    return callee.value(S, *args)
+  except (_DeathError, RecursionError) as error:
+    # Running out of stack is not the builtin's fault; let the engine say so.
+    raise error # re-raise
+  except Exception as error:
+    _die(S, f'python exception: {error}')
+
+
+def _layout(obj):
+  """Evaluate the functions of the block of `obj` into its methods, unless it
+     was done already. This is done once, for the first instance."""
+  if obj.methods is None:
+    functions, obj.statements = [], []
+    for node in obj.block:
+      if node.type == 'Function':
+        functions.append(node)
+      elif node.type == 'ForBlock':
+        functions.extend(node.functions)
+      else:
+        obj.statements.append(node)
+    template = obj.state.child()
+    template.evaluate(template, functions)
+    # A method may be a variation of a function of the same name defined
+    # outside of the object; then it is those variations that it is in.
+    obj.frame = template.env
+    obj.methods = {node.name: template.env[node.name] for node in functions}
+
+
+def _instantiate(S, obj, args):
+  """Make an instance of the object `obj` out of the `args`."""
+  if not isinstance(obj, RyObject):
+    _die(S, f'value of type {obj.type} is not an object')
+  if len(args) != len(obj.props):
+    _die(S, f'"{obj.name}" expected {len(obj.props)} properties, got {len(args)}')
+  _layout(obj)
+  capsule = obj.state.copy()
+  capsule.env = _Members(obj)
+  # With patterns there is no clear list of parameters an object takes,
+  # and .env loses order which we depend on). The only work-around for
+  # extraction I could think of is with `extractable`:
+  extractable = []
+  for idx, (prop, arg) in enumerate(zip(obj.props, args)):
+    status, payload = _visit_pattern(capsule, prop, arg)
+    if not status:
+      _die(S, f'failed to instantiate {obj} on argument no. {idx + 1}: {payload}')
+    extractable.append(arg)
+  capsule.evaluate(capsule, obj.statements)
+  return RyRouteable(obj.name, capsule.env, extractable=extractable)
+
+
+def _builtin(S, name):
+  return RyBuiltin(
+    S.env.get(f'#:{name}', False) or _die(S, f'builtin "{name}" not found'))
+
+
+def _route(S, res, path):
+  """Follow the `path`, a list of property names, starting at `res`. The
+     properties of a routeable are what its frame has, and for an instance,
+     the methods of its object, too; not what the frame's parents have."""
+  for piece in path:
+    if res.type != 'routeable':
+      _die(S, f'type \'{res.type}\' is not routeable: {res}')
+    env = res.env
+    if not (piece in env.keys() or type(env) is _Members and piece in env.obj.methods):
+      _die(S, f'no property "{piece}" for {res}')
+    res = env[piece]
+  return res
+
+
+def _normal(value, floats=False):
+  """Make the result of arithmetic the value of a RyNum: a Fraction that is
+     integral is made an int, and one that is not, a float if `floats`."""
+  if type(value) is Fraction:
+    if value.denominator == 1:
+      return value.numerator
+    elif floats:
+      return float(value)
+  return value
+
+
+def _number(node):
+  """The value of a Number node, as an int or a Fraction."""
+  value = node.value
+  if 'x' in value:
+    return int(value, 16)
+  elif 'o' in value:
+    return int(value, 8)
+  elif 'b' in value:
+    return int(value, 2)
+  return _normal(Fraction(value)) if '.' in value else int(value)
+
+
+def _dict_key(S, key):
+  """Return the key of the value as a key of a dict (see `_key`), or die if
+     there is none."""
+  hashed = _key(key)
+  if hashed is None:
+    _die(S, f'{key} cannot be a key of a dict')
+  return hashed
+
+
+# Dicts keep the order their keys were first put in (see `_put`).
+_ORDER = count()
+
+
+def _put(S, entries, key, value):
+  """Return the hamt.Map of a dict with the key put into it. A key new to it
+     goes last; one it has stays where it is."""
+  hashed = _dict_key(S, key)
+  entry = entries.get(hashed)
+  return entries.put(hashed, (key, value, next(_ORDER) if entry is None else entry[2]))
+
+
+def _entries(entries):
+  """Return the (key, value) pairs of the hamt.Map of a dict, in order."""
+  triples = sorted((entry for _, entry in entries.items()), key=itemgetter(2))
+  return [(key, value) for key, value, _ in triples]
+
+
+def _dict(S, pairs):
+  """Make a dict of (key, value) pairs; the last of the pairs of a key wins."""
+  entries = Map()
+  for key, value in pairs:
+    entries = _put(S, entries, key, value)
+  return RyDict(entries)
+
+
+def _constant(node):
+  """If the node is a literal whose value is always the same (a number, a
+     string that interpolates nothing, or a vector of such literals), return
+     that value, made once and shared by every evaluation of the node;
+     otherwise, return None. Shared vectors hold a tuple, so that no one can
+     change them."""
+  try:
+    return node.constant
+  except AttributeError:
+    if node.type == 'Number':
+      node.constant = RyNum(_number(node))
+    elif node.type == 'String':
+      node.constant = RyStr(node.template[0]) if len(node.template) == 1 else None
+    elif node.type == 'Vector':
+      items = [_constant(item) for item in node.items]
+      node.constant = None if any(item is None for item in items) else RyVec(tuple(items))
+    else:
+      return None
+    return node.constant
+
+
+def _string(S, node):
+  """The value of a String node: fill the slots of its template with the
+     values of the variables named there."""
+  parts = [*node.template]
+  for index in range(1, len(parts), 2):
+    name = parts[index]
+    if name not in S.env:
+      _die(S, f'interpolation: variable "{name}" is not defined')
+    text = S.env.get(name)
+    parts[index] = text.value if isinstance(text, RyStr) else repr(text)
+  return RyStr(''.join(parts))
+
 ### Visitor ##############
 
 def _visit_node(S, node):
   """A mostly-tail-call-optimizing interpreter for Rydesta. Accepts single node
      or list (tuple) of nodes."""
+  # Whether `node` is in the tail of the body of the function being evaluated:
+  # a `ret` there returns from that function, not from its caller.
+  tail = False
   while True:
     if type(node) in (list, tuple):
       try:
@@ -418,12 +1428,11 @@ def _visit_node(S, node):
       S.line = node.line
       if node.type == 'Cases':
         head = _visit_node(S, node.head)
-        node.cases.sort(
-          # ValueCases have priority over MatchCases.
-          key=lambda x: 2**32 if x.type == 'ValueCase' else _prioritize(x.cond),
-          reverse=True)
-        for case in node.cases:
-          if case.type == 'MatchCase':
+        for case in _plan_cases(node):
+          if type(case) is _CaseTable:
+            case = case.pick(S, head)
+            status = case is not None
+          elif case.type == 'MatchCase':
             # In cases, P_Discard has the highest priority.
             if case.cond.type == 'P_Discard':
               status = True
@@ -435,89 +1444,50 @@ def _visit_node(S, node):
             if not case.body:
               # If the case body is empty, return true.
               return RyBool(True)
-            _visit_node(S, case.body[:-1])
+            try:
+              _visit_node(S, case.body[:-1])
+            except _ReturnException as ret:
+              if not tail:
+                raise
+              return ret.value
             node = case.body[-1]
             break
         if not status:
           return RyBool(False)
         # TCO: continue looping...
       elif node.type == 'Function':
-        function = RyFunction(S,
-          RyPriority.SLURPY if node.slurpy else _prioritize(node.params),
-          node.name, node.params, node.body)
-        variations = S.env.get(node.name, False)
-        if node.name.startswith('\'') and function.arity not in (1, 2):
-          _die(S,
-            'expected either a prefix (arity = 1) or infix (arity = 2), ' \
-            f'got arity = {function.arity}')
-        # If the function exists, make this one one of its variations.
-        if isinstance(variations, RyVariations):
-          if variations.quoting != node.quoting:
-            _die(S, f'expected variation `{function}` to be quoting')
-          elif variations.naked != node.naked:
-            _die(S, f'expected variation `{function}` to be naked')
-          variations.add(function)
-        else:
-          S.env[node.name] = variations = RyVariations(
-            node.name, function,
-            quoting = node.quoting,
-            naked = node.naked)
-        if not node.naked:
-          # Make it a closure but with recursion available.
-          function.state = function.state.copy()
-        return variations
+        return _define(S, node)
       elif node.type == 'If':
         cond = _visit_node(S, node.cond)
         if not (isinstance(cond, RyBool) and cond.value is False):
           if not node.correct:
             # If the body is empty, just return true.
             return RyBool(True)
-          _visit_node(S, node.correct[:-1])
-          node = node.correct[-1]
+          body = node.correct
         elif node.other:
-          _visit_node(S, node.other[:-1])
-          node = node.other[-1]
+          body = node.other
         else:
           # If there is no `else` clause and the condition is false, return false.
           return RyBool(False)
+        try:
+          _visit_node(S, body[:-1])
+        except _ReturnException as ret:
+          if not tail:
+            raise
+          return ret.value
+        node = body[-1]
         # TCO: continue looping...
       elif node.type == 'Object':
-        S.env[node.name] = (RySecretObject if node.secret else RyObject)(
-          node.name,
-          node.properties,
-          node.block,
-          S.copy())
-        return RyNothing()
+        return _define_object(S, node)
       elif node.type == 'Ret':
-        raise _ReturnException(_visit_node(S, node.value))
+        if not tail:
+          raise _ReturnException(_visit_node(S, node.value))
+        node = node.value
       elif node.type == 'ForBlock':
         _visit_node(S, node.functions[:-1])
         node = node.functions[-1]
       elif node.type == 'Needs':
-        cache = S.env['MODULE-CACHE'].value
-        for location in S.env['PATH'].value.split(';'):
-          path = (Path(location) / f'{"_" if node.hidden else ""}{node.module}.ry').absolute()
-          if path.exists():
-            source, path = path.read_text(), str(path)
-            if path not in map(attrgetter('value'), cache):
-              from .master import Master
-              master = Master(path)
-              master.kernel()
-              master.boot()
-              # Some strange Python-memory-related problem:
-              master.state = master.state.copy()
-              master.feed(source)
-              S.reader.merge(master.reader)
-              exports = {e: v for e, v in master.state.env.items() if not e.startswith('_')}
-              if node.expose:
-                S.env.update(exports)
-                S.env['MODULE-CACHE'].value.update({*cache, RyStr(path)})
-              else:
-                S.env['MODULE-CACHE'].value.add(RyStr(path))
-                name = node.module.split('/')[-1].capitalize()
-                S.env[name] = RyRouteable(node.module, exports)
-            return RyNothing()
-        _die(S, f'%smodule not found: "{node.module}"' % ('hidden ' if node.hidden else ''))
+        return _needs(S, node)
       elif node.type == 'Assign':
         value = _visit_node(S, node.value)
         status, payload = _visit_pattern(S, node.pattern, value)
@@ -529,36 +1499,13 @@ def _visit_node(S, node):
         if node.callee.type == 'Request':
           if len(node.args) == 1:
             if node.callee.name == 'unquote':
-              quoted = _visit_node(S, node.args[0])
-              if not isinstance(quoted, RyExcerpt):
-                _die(S, f'cannot unquote a non-excerpt value: {quoted}')
-              return _visit_node(quoted.state.copy(), quoted.node)
+              return _unquote(S, _visit_node(S, node.args[0]))
             elif node.callee.name == 'quote':
               return RyExcerpt(S, node.args[0])
         callee = _visit_node(S, node.callee)
-        # Type-like functions implement Rydesta's sole type-casting mechanism.
-        #   num "12.34" -> 12
-        #   str 12.34 -> "12.34"
-        #   vec "hello!" -> ["h" "e" "l" "l" "o" "!"]
         if isinstance(callee, RyTypeType):
           if len(node.args) == 1:
-            arg = _visit_node(S, node.args)[0]
-            if callee.value == 'num':
-              if isinstance(arg, RyStr): # num "12.34" ==> 12.34
-                try:
-                  return RyNum(Fraction(arg.value))
-                except ValueError as error:
-                  _die(S, f'was not able to convert to num: {arg}')
-            elif callee.value == 'str':
-              if isinstance(arg, RyNum): # str 12.34 ==> "12.34"
-                return RyStr(repr(arg))
-            elif callee.value == 'vec':
-              if isinstance(arg, RyStr): # vec "hello" ==> ["h" "e" "l" "l" "o"]
-                return RyVec([RyStr(ch) for ch in arg.value])
-            elif callee.value == 'type':
-              # A nice way to get an entity's type!
-              return RyTypeType(arg.type)
-            _die(S, f'no special-form "{callee.value}" to convert {arg} to {callee})')
+            return _convert(S, callee, _visit_node(S, node.args)[0])
         elif isinstance(callee, RyVariations):
           # Here the "normal" function calls, those to `variations`, are processed.
           if callee.quoting:
@@ -566,37 +1513,7 @@ def _visit_node(S, node):
             args = [RyExcerpt(S, arg) for arg in node.args]
           else:
             args = _visit_node(S, node.args)
-          # The algorithm works as follows: we iterate through the variations,
-          # which are already sorted by priority, and try to apply the `args`.
-          # + On success we make the variation's capsule and dive into it.
-          # + On failure, which means getting to the last variation and not matching,
-          #   we err and give a briefing on the variations tried.
-          varc = len(callee.variations)
-          for index, variation in enumerate(callee.variations):
-            capsule = variation.state.copy()
-            if variation.priority == RyPriority.SLURPY:
-              status, _ = _visit_pattern(capsule, variation.params[0], RyVec(args))
-              if status:
-                break
-            elif variation.arity == len(args):
-              if variation.arity == 0:
-                status = True
-                break
-              for param, arg in zip(variation.params, args):
-                status, _ = _visit_pattern(capsule, param, arg)
-                if not status:
-                  break
-              if status: # All arguments matched.
-                break
-            elif index == varc - 1:
-              status = False
-              break
-            del capsule
-          if not status: # Not one of the variations matched. Dump all available.
-            variations = '\n'.join(x.dump() for x in callee.variations)
-            _die(S,
-              f'of these variations:\n{indent(variations, " " * 2)}\n' \
-              f'none matched the {len(args)} argument(s) given: {", ".join(map(repr, args))}')
+          variation, capsule = _dispatch(S, callee, args, node)
           if not variation.body:
             return RyNothing()
           # Process the top-to-bottom except-last-one body. Catch returns
@@ -606,52 +1523,25 @@ def _visit_node(S, node):
           except _ReturnException as ret:
             return ret.value
           S = capsule
-          # Ignore the last-line return.
-          last = variation.body[-1]
-          node = last.value if last.type == 'Ret' else last
+          node = variation.body[-1]
+          tail = True
           # TCO: continue looping...
         elif isinstance(callee, RyBuiltin):
-          try:
-            return callee.value(S, *_visit_node(S, node.args))
-          except _DeathError as error:
-            raise error # re-raise
-          except Exception as error:
-            _die(S, f'python exception: {error}')
+          return _call_builtin(S, callee, _visit_node(S, node.args))
         else:
           _die(S, f'callee of type {callee.type} is not callable: {callee}')
       elif node.type == 'Instance':
         obj, args = _visit_node(S, [node.callee, node.args])
-        if not isinstance(obj, RyObject):
-          _die(S, f'value of type {obj.type} is not an object')
-        if len(args) != len(obj.props):
-          _die(S, f'"{obj.name}" expected {len(obj.props)} properties, got {len(args)}')
-        capsule = obj.state.copy()
-        # With patterns there is no clear list of parameters an object takes,
-        # and .env loses order which we depend on). The only work-around for
-        # extraction I could think of is with `extractable`:
-        extractable = []
-        for idx, (prop, arg) in enumerate(zip(obj.props, args)):
-          status, payload = _visit_pattern(capsule, prop, arg)
-          if not status:
-            _die(S, f'failed to instantiate {obj} on argument no. {idx + 1}: {payload}')
-          extractable.append(arg)
-        _visit_node(capsule, obj.block)
-        return RyRouteable(obj.name, capsule.env, extractable=extractable)
+        return _instantiate(S, obj, args)
       elif node.type == 'Builtin':
-        return RyBuiltin(
-          S.env.get(f'#:{node.name}', False) or _die(S, f'builtin "{node.name}" not found'))
+        return _builtin(S, node.name)
       elif node.type == 'Path':
-        res = _visit_node(S, node.parent)
-        for piece in node.path:
-          if res.type != 'routeable':
-            _die(S, f'type \'{res.type}\' is not routeable: {res}')
-          res = res.env.get(piece) or _die(S, f'no property "{piece}" for {res}')
-        return res
+        return _route(S, _visit_node(S, node.parent), node.path)
       elif node.type == 'Request':
-        value = S.env.get(node.name, False)
-        if value is False:
+        try:
+          return S.env[node.name]
+        except KeyError:
           _die(S, f'"{node.name}" is not defined')
-        return value
       elif node.type == 'Expect':
         # Evaluate the guard; die if it's false.
         guard = _visit_node(S, node.guard)
@@ -659,32 +1549,23 @@ def _visit_node(S, node):
           _die(S, f'expectation false')
         return RyNothing()
       elif node.type == 'Vector':
-        return RyVec(_visit_node(S, node.items))
+        value = _constant(node)
+        return RyVec(_visit_node(S, node.items)) if value is None else value
+      elif node.type == 'Dict':
+        return _dict(S, [(_visit_node(S, key), _visit_node(S, value))
+          for key, value in zip(node.keys, node.values)])
       elif node.type == 'Number':
-        value = node.value
-        if 'x' in value:
-          value = int(value, 16)
-        elif 'o' in value:
-          value = int(value, 8)
-        elif 'b' in value:
-          value = int(value, 2)
-        return RyNum(Fraction(value))
+        return _constant(node)
       elif node.type == 'String':
-        def _format(match):
-          name = match.group(1)
-          if name not in S.env:
-            _die(S, f'interpolation: variable "{name}" is not defined')
-          text = S.env.get(name)
-          return text.value if isinstance(text, RyStr) else repr(text)
-        value = re.sub(r'\$([a-zA-Z][a-zA-Z0-9_\-]*(?<!\-)\??)', _format, node.value)
-        return RyStr(bytes(value, 'utf-8').decode('unicode-escape'))
+        value = _constant(node)
+        return _string(S, node) if value is None else value
       else:
         raise NotImplementedError(f'internal error: .visit: {node}')
 
 
 ###- ENTRY -##############
 
-def visit(state):
+def visit(state, *, trace=None):
   try:
     try:
       last = None
@@ -692,7 +1573,9 @@ def visit(state):
         node = state.reader.next()
         if not node:
           break
-        last = _visit_node(state, node)
+        if trace is not None:
+          trace(node)
+        last = state.evaluate(state, node)
       return last
     except _ReturnException:
       _die(state, '"ret" outside a function')
@@ -1,21 +1,101 @@
 import operator
 
+from fractions import Fraction
+
+from .cache import ParseCache
+from .registry import Registry
 from .reader import Reader
+from .compiler import evaluate as compiled
+from .vm import evaluate as executed, DEPTH
 
-from .machine import RyState, visit, _die
-from .machine import RyBool, RyVec, RyStr, RyNum, HasType, RyTypeType
+from .machine import (
+  RyState, visit, _die, _Overlay, _Public, _visit_node, _normal, _join, _Slice, _key, _put, _Lazy, _items, _pythonic)
+from .machine import (
+  RyBool, RyVec, RyStr, RyNum, RyDict, RySeq, RyNothing, HasType, RyTypeType, RyVariations)
 
 from pathlib import Path
+from itertools import chain, count, takewhile
+from math import floor
+
+
+# The engines a master can evaluate nodes with.
+ENGINES = {'tree': _visit_node, 'closures': compiled, 'vm': executed}
+
+# The boxes `#:wraps` may wrap a Python value in, by the name of their type.
+WRAPPERS = {klass.type: klass for klass in HasType.__subclasses__()}
+
+# The booted images, by the settings of the masters they are for (see `Master.image`).
+IMAGES = {}
+
+# The registries of modules, by the settings of the masters that evaluate them.
+REGISTRIES = {}
+
+# The comparisons of nums the kernel provides, by the name of the builtin.
+COMPARISONS = {'lt': operator.lt, 'gt': operator.gt, 'le': operator.le, 'ge': operator.ge}
 
 
 class Master:
   """A simple, intuitive way to interact with the complete Rydesta
      infrastructure. And the sole way to get the kernel, too."""
 
-  def __init__(self, filename):
-    self.reader = Reader()
-    self.state = RyState(str(filename), self.reader)
+  def __init__(self, filename, *,
+      packrat=False, cache=True, engine='tree', depth=DEPTH, floats=False, reload=False):
+    """`packrat` is passed on to the Reader. If `cache` is True, files are
+       read through the on-disk cache of parsed nodes (see ParseCache). The
+       `engine` is one of ENGINES: 'tree' walks the tree of every node it
+       evaluates, 'closures' compiles nodes into closures first, and 'vm'
+       into bytecode. The 'vm' keeps a stack of frames of its own, and dies
+       when it is `depth` frames deep. Arithmetic is exact; but if `floats`
+       is True, its results that are not integers are floats, not Fractions.
+       Modules are evaluated once per process (see Registry); if `reload` is
+       True, one whose file was modified since is evaluated again. If set,
+       `trace` is called with every top-level node fed to the master before
+       it is evaluated."""
+    if depth < 1:
+      raise ValueError(f'depth must be 1 frame or more, got {depth}')
+    self.reader = Reader(packrat=packrat)
+    self.engine = engine
+    self.depth = depth
+    self.floats = floats
+    self.reload = reload
+    self.trace = None
+    self.state = RyState(str(filename), self.reader, master=self, evaluate=ENGINES[engine])
     self.basis = Path(__file__).parents[1] / "basis"
+    self.cache = cache
+    # What makes two masters evaluate the same source the same way.
+    self.settings = packrat, cache, engine, depth, floats
+    self.registry = REGISTRIES.setdefault(self.settings, Registry())
+    # The names the kernel defined (see `kernel`).
+    self.primitives = frozenset()
+    # The frame this master sees the booted image through (see `boot`), and
+    # the frames it sees the modules it needs through (see `_needs`).
+    self.overlay = None
+    self.overlays = {}
+
+  def spawn(self, filename):
+    """Make a master, with the kernel and the basis, for a module this one
+       needs. It is set up the same way as this one, and so, is given the
+       same booted image."""
+    master = Master(filename,
+      packrat=self.reader.packrat, cache=self.cache, engine=self.engine, depth=self.depth,
+      floats=self.floats, reload=self.reload)
+    master.kernel()
+    master.boot()
+    return master
+
+  def exports(self):
+    """Return what this master's module exports: what it defined, except
+       for the private names and the names of the kernel, and the functions
+       of the basis it added variations to."""
+    exports = {name: value for name, value in self.state.env.items()
+      if not name.startswith('_') and name not in self.primitives}
+    if self.overlay is not None:
+      image = self.overlay.parent
+      for name, value in self.overlay.items():
+        if isinstance(value, RyVariations) and not name.startswith('_') \
+            and len(value.variations) != len(image[name].variations):
+          exports.setdefault(name, value)
+    return exports
 
   def define(self, name, value):
     """Define a constant-like (but may not be a constant) value."""
@@ -42,7 +122,8 @@ class Master:
     """Set global guard precedence, a level with which guards work."""
     if not isinstance(precedence, RyNum):
       _die(state, '"set-guard-precedence" (no. 1) expects a num')
-    self.state.reader.switches['guard-precedence'] = int(precedence.value)
+    reader = self.state.reader
+    reader.switches = reader.switches.with_guard_precedence(int(precedence.value))
 
   def _k_builtin(self, state, name):
     """Get Python builtin from __builtins__."""
@@ -60,18 +141,25 @@ class Master:
     attr = getattr(obj, 'value')
     if attr is None:
       _die(state, f'could not convert "{obj}" to Python')
-    if type(attr) is list:
-      return [i.value if hasattr(i, 'value') else i for i in attr]
+    if type(attr) in (list, tuple, _Slice):
+      # Vecs may hold tuples or slices; Python is given lists, which it may change.
+      values = (i.value if hasattr(i, 'value') else i for i in attr)
+      return [list(value) if type(value) in (tuple, _Slice) else value for value in values]
     return attr
 
   def _k_wraps(self, state, typ, obj):
     """Wraps an object in 'typ', of TypeType."""
     if not isinstance(typ, RyTypeType):
       _die(state, f'"wraps" (no. 1) expects a type')
-    # XXX speed up!
-    for klass in HasType.__subclasses__():
-      if klass.type == typ.value:
-        return klass(obj)
+    elif typ.value == 'seq':
+      # A seq is pulled out of any Python iterable, a generator included.
+      try:
+        return RySeq(_Lazy(_pythonic(state, iter(obj))))
+      except TypeError:
+        _die(state, f'could not wrap "{obj}" in a seq: it is not iterable')
+    klass = WRAPPERS.get(typ.value)
+    if klass is not None:
+      return klass(obj)
 
   def _k_import(self, state, name):
     if not isinstance(name, RyStr):
@@ -84,6 +172,101 @@ class Master:
   def _k_state(self, state):
     return state
 
+  # The intrinsics below do natively what boot's operators did through the
+  # Python wrapper. Boot's guards pick the variation; they only check enough
+  # not to break if called directly.
+
+  def _k_of(self, state, entity, typ):
+    """Check if the entity is of the type (otherwise, or if `typ` is not a
+       type, false). Boot's `'of` is this."""
+    return RyBool(typ.type == 'type' and entity.type == typ.value)
+
+  def _k_add(self, state, lhs, rhs):
+    """Add two nums, or join two strs or two vecs. A seq joined with a vec
+       or a seq is a seq; it is lazy, too."""
+    if type(lhs) in (RyVec, RySeq) and type(rhs) in (RyVec, RySeq) and RySeq in (type(lhs), type(rhs)):
+      return RySeq(_Lazy(chain(_items(lhs), _items(rhs))))
+    elif type(lhs) is not type(rhs) or type(lhs) not in (RyNum, RyStr, RyVec):
+      _die(state, '"add" expects two nums, strs, vecs or seqs')
+    elif type(lhs) is RyNum:
+      return RyNum(_normal(lhs.value + rhs.value, self.floats))
+    elif type(lhs) is RyVec:
+      return RyVec(_join(lhs.value, rhs.value))
+    return RyStr(lhs.value + rhs.value)
+
+  def _k_sub(self, state, lhs, rhs):
+    """Subtract a num from a num."""
+    if type(lhs) is not RyNum or type(rhs) is not RyNum:
+      _die(state, '"sub" expects two nums')
+    return RyNum(_normal(lhs.value - rhs.value, self.floats))
+
+  def _k_mul(self, state, lhs, rhs):
+    """Multiply a num by a num, or repeat a str or a vec the integer part
+       of a num times."""
+    if type(rhs) is not RyNum or type(lhs) not in (RyNum, RyStr, RyVec):
+      _die(state, '"mul" expects a num, str or vec, and a num')
+    if type(lhs) is RyNum:
+      return RyNum(_normal(lhs.value * rhs.value, self.floats))
+    times = int(rhs.value)
+    return RyStr(lhs.value * times) if type(lhs) is RyStr else RyVec([*lhs.value] * times)
+
+  def _k_div(self, state, lhs, rhs):
+    """Divide a num by a non-zero num."""
+    if type(lhs) is not RyNum or type(rhs) is not RyNum:
+      _die(state, '"div" expects two nums')
+    if not rhs.value:
+      _die(state, 'division by zero')
+    lval, rval = lhs.value, rhs.value
+    if type(lval) is int and type(rval) is int:
+      if lval % rval == 0:
+        return RyNum(lval // rval)
+      lval = Fraction(lval)
+    return RyNum(_normal(lval / rval, self.floats))
+
+  def _k_get(self, state, mapping, key):
+    """Get what the key maps to in the dict, or nothing if it is not there."""
+    if not isinstance(mapping, RyDict):
+      _die(state, '"get" (no. 1) expects a dict')
+    entry = mapping.value.get(_key(key))
+    return RyNothing() if entry is None else entry[1]
+
+  def _k_put(self, state, mapping, key, value):
+    """Make a dict like the given one, but with the key mapping to the value."""
+    if not isinstance(mapping, RyDict):
+      _die(state, '"put" (no. 1) expects a dict')
+    return RyDict(_put(state, mapping.value, key, value))
+
+  def _k_drop(self, state, mapping, key):
+    """Make a dict like the given one, but without the key."""
+    if not isinstance(mapping, RyDict):
+      _die(state, '"drop" (no. 1) expects a dict')
+    return RyDict(mapping.value.drop(_key(key)))
+
+  def _k_has(self, state, mapping, key):
+    """Check if the key is in the dict."""
+    if not isinstance(mapping, RyDict):
+      _die(state, '"has" (no. 1) expects a dict')
+    return RyBool(_key(key) in mapping.value)
+
+  def _k_range(self, state, lo, hi):
+    """Make the lazy seq of nums from `lo` up to `hi`, inclusive, by one."""
+    if type(lo) is not RyNum or type(hi) is not RyNum:
+      _die(state, '"range" expects two nums')
+    lo, hi = lo.value, hi.value
+    if type(lo) is int and type(hi) is not float:
+      nums = range(lo, floor(hi) + 1)
+    else:
+      nums = takewhile(lambda num: num <= hi, count(lo))
+    return RySeq(_Lazy(map(RyNum, nums)))
+
+  def _compare(self, name):
+    compare = COMPARISONS[name]
+    def builtin(state, lhs, rhs):
+      if type(lhs) is not RyNum or type(rhs) is not RyNum:
+        _die(state, f'"{name}" expects two nums')
+      return RyBool(compare(lhs.value, rhs.value))
+    return builtin
+
   def kernel(self):
     """Initialize the kernel of Rydesta. It consists of builtins like #:getattr,
        to interact with Python intimately, some required values like PATH, MODULES,
@@ -100,15 +283,53 @@ class Master:
     for name in dir(self):
       if name.startswith('_k_'):
         self.builtin(name[3:].replace('_', '-'), getattr(self, name))
+    for name in COMPARISONS:
+      self.builtin(name, self._compare(name))
+    self.primitives = frozenset(self.state.env)
+
+  def image(self):
+    """Return the booted image for the settings of this master: the state
+       the basis was evaluated in, and the reader it was read by. The basis
+       is read for the first master with these settings; the other ones, in
+       this process, are given the same image."""
+    if self.settings not in IMAGES:
+      path = self.basis / 'boot.ry'
+      master = Master(path,
+        packrat=self.reader.packrat, cache=self.cache, engine=self.engine, depth=self.depth,
+        floats=self.floats)
+      master.kernel()
+      master.feed_file(path)
+      # Boot's `'of` is the type test function dispatch knows the meaning of,
+      # and may skip the variations whose `(x of T)` guards would veto.
+      test = master.get("'of")
+      if isinstance(test, RyVariations):
+        test.blessed = True
+      IMAGES[self.settings] = master.state, master.reader
+    return IMAGES[self.settings]
 
   def boot(self):
-    """Feed `needs boot exposed` if we're not boot."""
+    """Bring in the basis if we're not boot: the frame of this master is made
+       a child of an overlay of the frame of the booted image (which hides
+       its private names), and this master's reader is given the switches
+       the basis left its reader with. The variations of the image this
+       master adds to are its own, and so are the functions of the basis
+       that call them (see `_Overlay`)."""
     if 'basis/boot.ry' not in self.state.filename:
-      self.feed('needs boot exposed')
-    # XXX Don't know why it's required here; maybe a bug!
-    self.reader.update_symbol_regex()
+      state, reader = self.image()
+      self.overlay = _Overlay(state)
+      self.state.env.parent = _Public(self.overlay)
+      self.reader.merge(reader)
+      self.state.env['MODULE-CACHE'].value.add(RyStr(str(self.basis / 'boot.ry')))
 
   def feed(self, string):
     """Feed a string of source to the interpreter."""
     self.reader.update(string)
-    return visit(self.state)
+    return visit(self.state, trace=self.trace)
+
+  def feed_file(self, path):
+    """Feed the source found at the given path to the interpreter. The file
+       is read as the reader goes, so it never has to be in memory whole."""
+    cache = ParseCache(path) if self.cache else None
+    with open(path) as stream:
+      self.reader.update_stream(stream, cache=cache)
+      return visit(self.state, trace=self.trace)
@@ -1,6 +1,10 @@
 import re
+import hashlib
 
 from textwrap import indent
+from types import MappingProxyType
+from itertools import count
+from functools import wraps
 from collections import namedtuple
 
 
@@ -16,29 +20,305 @@ class ReaderError(Exception):
     self.line = line
 
 
+def _packrat(rule):
+  """Make a parser rule memoizing when the reader is in packrat mode. The
+     outcome of the rule (be it a node or False) and the index of the token it
+     stopped on are remembered by the rule, its arguments, the index it started
+     on and the grammar version. A rule called again in the same situation
+     just jumps to where it stopped the first time."""
+  @wraps(rule)
+  def memoized(self, *args):
+    if not self.packrat:
+      return rule(self, *args)
+    key = rule, args, self._index, self.version
+    if key in self._memo:
+      result, stop = self._memo[key]
+      self._seek(stop)
+      self.reparses_avoided += 1
+      return result
+    result = rule(self, *args)
+    self._memo[key] = result, self._index
+    return result
+  return memoized
+
+
 class RyNode:
-  """Rydesta's node system is not organized in a class-per-node-type way.
-     Instead it has just one, generic node class -- this one."""
-
-  def __init__(self, type_, line, **kwargs):
-    """Create a node of the given type with the given line number.
-       The zero or more of the following keyword arguments are thought of
-       as node properties."""
-    self.type = type_
+  """The base of Rydesta's nodes. Every kind of node is a subclass of this one
+     (see `_kind`), and keeps its properties in slots named after them."""
+
+  # `closure` and `code` are where the engines that compile nodes (into
+  # closures and into bytecode, respectively) keep a node compiled.
+  __slots__ = 'line', 'closure', 'code'
+
+  type = 'Node'
+  _fields = ()
+
+  def __init__(self, line, **kwargs):
+    """Create a node with the given line number. The keyword arguments are
+       the node's properties; all of the kind's `_fields` must be given."""
     self.line = line
-    self.props = kwargs
+    for name in self._fields:
+      setattr(self, name, kwargs[name])
 
-  def set(self, name, value):
-    """Create (or update) a node property."""
-    self.props[name] = value
+  @property
+  def props(self):
+    """The node's properties, in the order of `_fields`."""
+    return {name: getattr(self, name) for name in self._fields}
 
-  def __getattr__(self, name):
-    return self.props[name]
+  def set(self, name, value):
+    """Update a node property."""
+    setattr(self, name, value)
 
   def __repr__(self):
     return f'({self.type} {" ".join(f"{k}={v}" for k, v in self.props.items())})'
 
 
+def _kind(name, *fields, slots=()):
+  """Make the RyNode subclass for the kind of node called `name`, with
+     the given properties, and `slots` that are not properties."""
+  return type(name, (RyNode,), {'__slots__': fields + slots, 'type': name, '_fields': fields})
+
+
+#| Expressions & values:
+Request = _kind('Request', 'name')
+Builtin = _kind('Builtin', 'name')
+# `constant` is where the engines keep the value of a constant literal.
+String = _kind('String', 'value', 'template', slots=('constant',))
+Number = _kind('Number', 'value', slots=('constant',))
+Vector = _kind('Vector', 'items', slots=('constant',))
+Dict = _kind('Dict', 'keys', 'values')
+Path = _kind('Path', 'parent', 'path')
+# `cache` is the inline cache of the call site (see `machine._dispatch`).
+Call = _kind('Call', 'callee', 'args', slots=('cache',))
+Instance = _kind('Instance', 'callee', 'args')
+#| Patterns:
+P_Identifier = _kind('P_Identifier', 'name')
+# `separator` is the constant string it compares to, if any (see `machine._separator`).
+P_Compare = _kind('P_Compare', 'value', slots=('separator',))
+P_Discard = _kind('P_Discard')
+P_Unpack = _kind('P_Unpack', 'members')
+P_Guard = _kind('P_Guard', 'param', 'guard')
+P_Extract = _kind('P_Extract', 'obj', 'fields')
+P_DictExtract = _kind('P_DictExtract', 'keys', 'fields')
+P_DiscardMany = _kind('P_DiscardMany')
+P_DiscardMulti = _kind('P_DiscardMulti')
+P_NamedMany = _kind('P_NamedMany', 'name')
+P_NamedMulti = _kind('P_NamedMulti', 'name')
+#| Top-level:
+Assign = _kind('Assign', 'pattern', 'value')
+Function = _kind('Function', 'name', 'params', 'slurpy', 'quoting', 'body')
+ForBlock = _kind('ForBlock', 'functions')
+Umbrella = _kind('Umbrella', 'name', 'covers')
+Object = _kind('Object', 'name', 'secret', 'properties', 'block')
+Ret = _kind('Ret', 'value')
+Needs = _kind('Needs', 'module', 'hidden', 'expose')
+Expect = _kind('Expect', 'guard')
+MatchCase = _kind('MatchCase', 'cond', 'body')
+ValueCase = _kind('ValueCase', 'cond', 'body')
+# `plan` is the order the engines try the cases in (see `machine._plan_cases`).
+Cases = _kind('Cases', 'head', 'cases', slots=('plan',))
+If = _kind('If', 'cond', 'correct', 'other')
+
+
+_ESCAPES = {
+  'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '0': '\0',
+  '\\': '\\', '$': '$', '"': '"', "'": "'"
+}
+
+_TEMPLATE = re.compile(r'\\(.)|\$([a-zA-Z][a-zA-Z0-9_\-]*(?<!\-)\??)|[^\\$]+|\$')
+
+
+def _string(line, literal):
+  """Make the String node of a string literal (quotes included). Its template
+     is the text of the string, with the escapes decoded, split at the names
+     of the variables to interpolate: those are found at the odd indices.
+     E.g., "Hi, $name!\\n" is ('Hi, ', 'name', '!\\n')."""
+  template = ['']
+  for match in _TEMPLATE.finditer(literal, 1, len(literal) - 1):
+    escape, name = match.groups()
+    if name:
+      template += name, ''
+    else:
+      template[-1] += _ESCAPES[escape] if escape else match.group()
+  return String(line, value=literal[1:-1], template=tuple(template))
+
+
+class Grammar:
+  """An immutable, versioned snapshot of the switches a reader reads by.
+
+  Changing a switch yields a new snapshot, or this very one if the change
+  changes nothing. A snapshot remembers the snapshots its changes led to, so
+  readers making the same changes starting from the same snapshot (e.g., every
+  module booting the basis) end up sharing them by reference. The tables derived
+  from the switches are computed once per snapshot, on first use."""
+
+  __slots__ = (
+    'tokens', 'symbols', 'prefixes', 'keywords', 'precedence',
+    'guard_precedence', 'version', '_successors', '_derived')
+
+  _versions = count()
+
+  def __init__(self, *, tokens, symbols, prefixes, keywords, precedence, guard_precedence):
+    self.tokens = MappingProxyType(dict(tokens))
+    self.symbols = frozenset(symbols)
+    self.prefixes = frozenset(prefixes)
+    self.keywords = frozenset(keywords)
+    self.precedence = MappingProxyType(dict(precedence))
+    self.guard_precedence = guard_precedence
+    self.version = next(Grammar._versions) # unique among all snapshots
+    self._successors = {}
+    self._derived = {}
+
+  def __getitem__(self, switch):
+    """Look up a switch by its (hyphenated) name, e.g. 'guard-precedence'."""
+    return getattr(self, switch.replace('-', '_'))
+
+  def _switches(self):
+    return {switch: getattr(self, switch) for switch in Grammar.__slots__[:6]}
+
+  def _change(self, change, **switches):
+    """Return the snapshot that `change` leads to: one with the given `switches`
+       replaced, made only the first time the change is asked for."""
+    successor = self._successors.get(change)
+    if successor is None:
+      successor = self._successors[change] = Grammar(**{**self._switches(), **switches})
+    return successor
+
+  def _with_symbol(self, symbol, **switches):
+    # Operators and prefixes that are not words have to be lexed as symbols.
+    if not symbol[0].isalpha():
+      switches['symbols'] = self.symbols | {symbol}
+    return switches
+
+  def with_token(self, ttype, regex):
+    if self.tokens.get(ttype) == regex:
+      return self
+    return self._change(('token', ttype, regex), tokens={**self.tokens, ttype: regex})
+
+  def with_keyword(self, keyword):
+    if keyword in self.keywords:
+      return self
+    return self._change(('keyword', keyword), keywords=self.keywords | {keyword})
+
+  def with_prefix(self, prefix):
+    if prefix in self.prefixes and (prefix[0].isalpha() or prefix in self.symbols):
+      return self
+    return self._change(('prefix', prefix),
+      **self._with_symbol(prefix, prefixes=self.prefixes | {prefix}))
+
+  def with_operator(self, op, assoc, prec):
+    if self.precedence.get(op) == (assoc, prec) and (op[0].isalpha() or op in self.symbols):
+      return self
+    return self._change(('operator', op, assoc, prec),
+      **self._with_symbol(op, precedence={**self.precedence, op: (assoc, prec)}))
+
+  def with_guard_precedence(self, level):
+    if self.guard_precedence == level:
+      return self
+    return self._change(('guard-precedence', level), guard_precedence=level)
+
+  def merged(self, other):
+    """Return the snapshot with the switches of both this and the `other`
+       snapshot; where they disagree, the `other` one wins. If either of the
+       two already is that snapshot, it is returned as is."""
+    if other is self:
+      return self
+    switches = {
+      'tokens': {**self.tokens, **other.tokens},
+      'symbols': self.symbols | other.symbols,
+      'prefixes': self.prefixes | other.prefixes,
+      'keywords': self.keywords | other.keywords,
+      'precedence': {**self.precedence, **other.precedence},
+      'guard_precedence': other.guard_precedence
+    }
+    for candidate in (self, other):
+      if candidate._switches() == switches:
+        return candidate
+    return self._change(('merged', other), **switches)
+
+  ### Derived tables. ##############
+
+  def _derive(self, table, compute):
+    try:
+      return self._derived[table]
+    except KeyError:
+      value = self._derived[table] = compute()
+      return value
+
+  @property
+  def symbol_regex(self):
+    """The symbols joined together in a valid, escaped regex, longest first."""
+    return self._derive('symbol_regex', lambda: '|'.join(
+      map(re.escape, sorted(self.symbols, key=len, reverse=True))))
+
+  @property
+  def levels(self):
+    """Map each precedence level to the tuple of operators at it."""
+    def compute():
+      levels = {}
+      for op, (_, prec) in self.precedence.items():
+        levels[prec] = levels.get(prec, ()) + (op,)
+      return levels
+    return self._derive('levels', compute)
+
+  @property
+  def guard_operators(self):
+    """The operators a pattern guard can be made of."""
+    return self.levels.get(self.guard_precedence, ())
+
+  @property
+  def lexer(self):
+    """A pair of the lexer pattern, which has one named group per kind of token,
+       and the map of the groups of user-defined tokens to their token types."""
+    def compute():
+      kinds = {}
+      alternatives = []
+      # NOTE that user-defined tokens are given the highest lexical precedence!
+      for index, (type_, regex) in enumerate(sorted(self.tokens.items(), reverse=True)):
+        kinds[f'USER{index}'] = type_
+        alternatives.append(f'(?P<USER{index}>{regex})')
+      for kind, regex in (
+          ('ID', r'_?[a-zA-Z][a-zA-Z0-9_\-]*(?<!\-)\??'),
+          ('QUOTED', r'\'[^\d\s\'"\.\])},]+'),
+          ('BUILTIN', r'#:[a-zA-Z_\-]+(?<!\-)\??'),
+          ('NUM', r'0x[0-9A-Fa-f]+|0o[0-7]+|0b[01]+|[0-9]*\.[0-9]+|[1-9][0-9]*|0'),
+          ('STR', r'"([^\n"\\]|\\[nrtv\\$"\'0])*"'),
+          ('SYMBOL', self.symbol_regex),
+          ('SKIP', r'[ \t\r]+|;[^\n]*\n'),
+          ('NL', r'\n+'),
+          ('EOF', r'\x00')):
+        alternatives.append(f'(?P<{kind}>{regex})')
+      return re.compile('|'.join(alternatives)), kinds
+    return self._derive('lexer', compute)
+
+  @property
+  def digest(self):
+    """A digest of the switches. Equal digests mean equal grammars."""
+    return self._derive('digest', lambda: hashlib.sha1(repr([
+      (switch, sorted(value.items()) if isinstance(value, MappingProxyType) else
+               sorted(value) if isinstance(value, frozenset) else value)
+        for switch, value in self._switches().items()]).encode()).hexdigest())
+
+
+# The grammar every reader starts with.
+BASIS = Grammar(
+  tokens={},
+  symbols={
+    '->', '=>', '!', '_',
+    '=', '.', ',', '(', ')',
+    '[', ']', '{', '}',
+    '*', '+'
+  },
+  prefixes=set(),
+  keywords={
+    'for', 'expect', 'ret', 'if', 'else', 'case', 'needs',
+    'hidden', 'exposed', 'new', 'obj', 'secret', 'umbrella',
+    'quoting', 'slurpy'
+  },
+  precedence={},
+  guard_precedence=1)
+
+
 class Reader:
   """
   This class implements the reader of the Rydesta programming language. It is
@@ -57,75 +337,85 @@ class Reader:
   False
   """
 
-  def __init__(self):
-    self.switches = {
-      'tokens': {},
-      'symbols': {
-        '->', '=>', '!', '_',
-        '=', '.', ',', '(', ')',
-        '[', ']', '{', '}',
-        '*', '+'
-      },
-      'prefixes': set(),
-      'keywords': {
-        'for', 'expect', 'ret', 'if', 'else', 'case', 'needs',
-        'hidden', 'exposed', 'new', 'obj', 'secret', 'umbrella',
-        'quoting', 'naked', 'slurpy'
-      },
-      'precedence': {},
-      'guard-precedence': 1
-    }
+  def __init__(self, *, packrat=False, grammar=BASIS):
+    """If `packrat` is True, the expression and pattern rules memoize their
+       results; `reparses_avoided` counts how many times that helped. The
+       reader starts reading by the given `grammar` snapshot."""
+    self.packrat = packrat
+    self.reparses_avoided = 0
+    self.switches = grammar
     self.precedence = 1 # precedence level is global
-    self.update_symbol_regex()
+    self._journal = None
+    self._cache = None
 
-  ### Public utility. ##############
+  @property
+  def version(self):
+    """The version of the grammar snapshot in effect."""
+    return self.switches.version
 
-  def update_symbol_regex(self):
-    """Join the symbols and the user-defined operators together in a valid,
-       escaped regex."""
-    self._symbol_regex = '|'.join(
-      map(re.escape,
-        sorted(self.switches['symbols'],
-               key=len, reverse=True)))
+  ### Public utility. ##############
 
   def merge(self, other):
     """Merge the switches from this parser with the switches of another one."""
-    for switch, value in other.switches.items():
-      if type(value) in (dict, set):
-        self.switches[switch].update(value)
-      else:
-        self.switches[switch] = value
-
-  def update(self, source):
-    """Roll back the reader's progress and substitute the source."""
-    self.pos = 0
-    self.line = 1
-    self.token = Token('BOL', '')
-    self.source = source + '\n\x00'
+    self.switches = self.switches.merged(other.switches)
+
+  def update(self, source, *, cache=None):
+    """Roll back the reader's progress and substitute the source. If given
+       a ParseCache for the source, replay the top-level nodes it holds for as
+       long as the grammar agrees with the one they were read under."""
+    self._substitute(source + '\n\x00', None, cache)
+
+  def update_stream(self, stream, *, cache=None, chunk=2**16):
+    """Same as `update`, but read the source from a text stream (e.g., an
+       open file), `chunk` characters at a time and only as far as needed.
+       The source already read through is forgotten as the reader moves on
+       from one top-level node to the next."""
+    self._substitute('', lambda: stream.read(chunk), cache)
+
+  def _substitute(self, source, more, cache):
+    # `source` is a window into the whole source, starting at `_offset`;
+    # `_more` reads what follows the window, or is None if nothing does.
+    # The window holds whole lines up to `_whole`, its last newline.
+    self.source = source
+    self._offset = 0
+    self._more = more
+    self._whole = source.rfind('\n')
+    self._cache = cache
+    self._restart(0, 1)
     # XXX bad?
     self._for_argc = []
 
+  def fingerprint(self):
+    """Return a digest of the switches and of the precedence level in effect.
+       Readers with equal fingerprints read a source into equal nodes."""
+    return self.switches.digest, self.precedence
+
+  def _journaled(self, method, *args):
+    """Note down a grammar-changing call, so a cache can replay it."""
+    if self._journal is not None:
+      self._journal.append((method, args))
+
   def add_prefix(self, prefix):
     """Add a new prefix type. Assume it is in uppercase."""
-    self.switches['prefixes'].add(prefix)
-    if not prefix[0].isalpha():
-      self.switches['symbols'].add(prefix)
+    self._journaled('add_prefix', prefix)
+    self.switches = self.switches.with_prefix(prefix)
 
   def add_keyword(self, keyword):
     """Add a new keyword. Note that an exact match is performed when lexing."""
-    self.switches['keywords'].add(keyword)
+    self._journaled('add_keyword', keyword)
+    self.switches = self.switches.with_keyword(keyword)
 
   def add_operator(self, op, assoc, prec):
     """Add a new operator type. Assume `op` is in uppercase."""
-    self.switches['precedence'].update({op: (assoc, prec)})
-    if not op[0].isalpha():
-      self.switches['symbols'].add(op)
+    self._journaled('add_operator', op, assoc, prec)
+    self.switches = self.switches.with_operator(op, assoc, prec)
 
   def add_token(self, ttype, regex):
     """Add a new token. Note that since these tokens are given the highest
        priority, it is highly hazardous to define some this way. Assume
        the token type is in uppercase."""
-    self.switches['tokens'].update({ttype: regex})
+    self._journaled('add_token', ttype, regex)
+    self.switches = self.switches.with_token(ttype, regex)
 
   ### Private utility. ##############
 
@@ -153,53 +443,114 @@ class Reader:
 
   ### Lexer. ##############
 
-  def _match(self, pattern):
-    """Try to match the working slice of the source against the given pattern.
-       If successful, store the matched result in the lexical buffer and increment
-       the position counters (pos, lineno). On failure, return False."""
-    match = re.match(pattern, self.source[self.pos:])
-    if match is not None:
-      matched = match.group()
-      self.buf = matched
-      self.pos += len(matched)
-      self.line += matched.count('\n')
-      return True
-    return False
-
   def _mk_token(self, type_, *, value=True):
     return Token(type_, self.buf if value else '')
 
   def _progress(self):
     """Read a full token and return it. Skip whitespaces. Raise ReaderError
        on an uncaptured lexeme."""
-    # NOTE that user-defined tokens are given the highest lexical precedence!
-    for type_, token in sorted(self.switches['tokens'].items(), reverse=True):
-        if self._match(token):
-          return self._mk_token(type_)
-    if self._match(r'_?[a-zA-Z][a-zA-Z0-9_\-]*(?<!\-)\??'):
-      if self.buf in self.switches['keywords']:
-        return self._mk_token(self.buf.upper())
-      return self._mk_token('ID')
-    elif self._match(r'\'[^\d\s\'"\.\])},]+'):
-      return self._mk_token('ID')
-    elif self._match(r'#:[a-zA-Z_\-]+(?<!\-)\??'):
-      return self._mk_token('BUILTIN')
-    elif self._match(r'0x[0-9A-Fa-f]+|0o[0-7]+|0b[01]+|[0-9]*\.[0-9]+|[1-9][0-9]*|0'):
-      return self._mk_token('NUM')
-    elif self._match(r'"([^\n"\\]|\\[nrtv\\$"\'0])*"'):
-      return self._mk_token('STR')
-    elif self._match(self._symbol_regex):
-      return self._mk_token(self.buf)
-    elif self._match(r'[ \t\r]+|;[^\n]*\n'):
-      return self._progress() # ignore
-    elif self._match(r'\n+'):
-      return self._mk_token('NL', value=False)
-    elif self._match(r'\x00'):
-      return self._mk_token('EOF', value=False)
+    lexer, kinds = self.switches.lexer
+    while True:
+      at = self.pos - self._offset
+      if self._more is not None and at >= self._whole:
+        # Lexemes do not span lines, but the line here is not read whole.
+        self._read()
+        continue
+      match = lexer.match(self.source, at)
+      if self._more is not None and match is not None and match.end() == len(self.source):
+        # Except for newlines, which may go on in the part not yet read.
+        self._read()
+        continue
+      if match is None:
+        raise ReaderError(
+          f'uncaptured lexeme "{self.source[at]}"; ' \
+          f'last valid token was {self._pretty_token_type()}', self.line)
+      self.buf = match.group()
+      self.pos += len(self.buf)
+      self.line += self.buf.count('\n')
+      kind = match.lastgroup
+      if kind == 'ID':
+        if self.buf in self.switches.keywords:
+          return self._mk_token(self.buf.upper())
+        return self._mk_token('ID')
+      elif kind == 'QUOTED':
+        return self._mk_token('ID')
+      elif kind in ('BUILTIN', 'NUM', 'STR'):
+        return self._mk_token(kind)
+      elif kind == 'SYMBOL':
+        return self._mk_token(self.buf)
+      elif kind in ('NL', 'EOF'):
+        return self._mk_token(kind, value=False)
+      elif kind != 'SKIP': # skipped ones are ignored
+        return self._mk_token(kinds[kind])
+
+  def _read(self):
+    """Extend the source window with the next chunk of the stream."""
+    chunk = self._more()
+    if not chunk:
+      chunk = '\n\x00'
+      self._more = None
+    self.source += chunk
+    self._whole = self.source.rfind('\n')
+
+  def _slide(self, pos):
+    """Move the start of the source window forward to `pos`."""
+    while self._more is not None and pos - self._offset > len(self.source):
+      self._offset += len(self.source)
+      self.source = ''
+      self._read()
+    self.source = self.source[pos - self._offset:]
+    self._offset = pos
+    self._whole = self.source.rfind('\n')
+
+  ### Token buffer. ##############
+
+  def _restart(self, pos, line):
+    """Forget the tokens read so far and continue reading from `pos`, which
+       is on the given line."""
+    if pos != self._offset:
+      self._slide(pos)
+    # Tokens already read, each with the position and line it ends at and
+    # the grammar version it was lexed under. `_index` points to the current.
+    self._buffer = [(Token('BOL', ''), pos, line, self.version)]
+    self._seek(0)
+    self._memo = {}
+
+  def _forget(self):
+    """Forget the tokens before the current one, save for the one just before
+       it (see `_start`), and the source they were read from. Only safe at the
+       top level, where nothing can backtrack past the current token."""
+    keep = self._index - 1
+    if keep > 0:
+      del self._buffer[:keep]
+      self._index -= keep
+      self._memo = {}
+      # Slide only when it saves a sizeable amount, as it copies the window.
+      if self._buffer[0][1] - self._offset > len(self.source) // 2:
+        self._slide(self._buffer[0][1])
+
+  def _start(self):
+    """Return the position and the line the current token starts at."""
+    _, pos, line, _ = self._buffer[self._index - 1 if self._index else 0]
+    return pos, line
+
+  def _seek(self, index):
+    """Make the buffered token at `index` the current one."""
+    self.token, self.pos, self.line, _ = self._buffer[index]
+    self._index = index
+
+  def _advance(self):
+    """Make the token following the current one current. Take it from the
+       buffer if it was lexed under the present grammar; otherwise, forget
+       the stale rest of the buffer and lex a fresh token."""
+    index = self._index + 1
+    if index < len(self._buffer) and self._buffer[index][3] == self.version:
+      self._seek(index)
     else:
-      raise ReaderError(
-        f'uncaptured lexeme "{self.source[self.pos]}"; ' \
-        f'last valid token was {self._pretty_token_type()}', self.line)
+      del self._buffer[index:]
+      self.token = self._progress()
+      self._buffer.append((self.token, self.pos, self.line, self.version))
+      self._index = index
 
   ### Common parsing helpers. ##############
 
@@ -217,8 +568,8 @@ class Reader:
        of any of the types, or if no types were given at all, return False."""
     if self.token.type in types:
       consumed = self.token
-      if self.pos < len(self.source):
-        self.token = self._progress()
+      if consumed.type != 'EOF':
+        self._advance()
       return consumed
     return False
 
@@ -247,14 +598,15 @@ class Reader:
   def _isolate(self, unit):
     """Call the given unit and return the result, if it is not False.
        If it is, revert the state of the parser to the state before
-       the call and return False."""
+       the call and return False. The tokens read in between stay in the
+       buffer, so going back is just moving the index."""
     #- Save!
-    before = self.token, self.pos, self.line
+    before = self._index
     result = unit()
     if result is not False:
       return result
     #- Restore!
-    self.token, self.pos, self.line = before
+    self._seek(before)
     return False
 
   def _any_of(self, *choices):
@@ -270,6 +622,7 @@ class Reader:
 
   #| Expressions & values:
 
+  @_packrat
   def _value(self):
     # value ::= value {"." ID} -> Path(parent, [str]path)
     #   | ID -> Request(name)
@@ -277,6 +630,7 @@ class Reader:
     #   | STR -> String(value)
     #   | NUM -> Number(value)
     #   | "[" {value} "]" -> Vector([]items)
+    #   | dict
     #   | "(" infix ")"
     #   / False
     line = self.line
@@ -284,18 +638,23 @@ class Reader:
     if token is False:
       return False
     if token.type == 'ID':
-      node = RyNode('Request', line, name=token.value)
+      node = Request(line, name=token.value)
     elif token.type == 'BUILTIN':
-      node = RyNode('Builtin', line, name=token.value[2:]) # cut the "#:" part
+      node = Builtin(line, name=token.value[2:]) # cut the "#:" part
     elif token.type == 'STR':
-      node = RyNode('String', line, value=token.value[1:-1]) # cut the quotes
+      node = _string(line, token.value)
     elif token.type == 'NUM':
-      node = RyNode('Number', line, value=token.value)
+      node = Number(line, value=token.value)
     elif token.type == '[':
-      items = self._kleene_until(']', self._value, allow_nl=True)
-      if items is False:
-        self._expected(f'a vector item or "]" when reading a vector', line)
-      node = RyNode('Vector', line, items=items)
+      pairs = self._pairs(self._value, self._value)
+      if pairs is not False:
+        keys, values = zip(*pairs) if pairs else ((), ())
+        node = Dict(line, keys=[*keys], values=[*values])
+      else:
+        items = self._kleene_until(']', self._value, allow_nl=True)
+        if items is False:
+          self._expected(f'a vector item or "]" when reading a vector', line)
+        node = Vector(line, items=items)
     elif token.type == '(':
       node = self._infix()
       if node is False:
@@ -308,8 +667,35 @@ class Reader:
       if part is False:
         self._expected('an identifier', line)
       path.append(part.value)
-    return node if not path else RyNode('Path', line, parent=node, path=path)
+    return node if not path else Path(line, parent=node, path=path)
+
+  def _pairs(self, key, unit):
+    # dict ::= "[" "=>" "]" -> []
+    #   | "[" (key "=>" unit)+ "]" -> [](key, unit)
+    #   / False
+    # (The "[" is already consumed.)
+    line = self.line
+    if self._consume('=>'):
+      if self._consume(']') is False:
+        self._expected('"]" to close the empty dict', line)
+      return []
+    def pair():
+      name = key()
+      if name is False or self._consume('=>') is False:
+        return False
+      value = unit()
+      if value is False:
+        self._expected('what the key maps to, after "=>"', line)
+      return name, value
+    before = self._index
+    pairs = self._kleene_until(']', pair, allow_nl=True)
+    if not pairs:
+      # Not a dict, but maybe a vector; `[]` is an empty vector.
+      self._seek(before)
+      return False
+    return pairs
 
+  @_packrat
   def _call(self):
     # call ::= (ID | BUILTIN | "(") {value} -> Call(callee, []args)
     #   | NEW ID {value} -> Instance(callee, []args)
@@ -322,7 +708,7 @@ class Reader:
     new = self._consume('NEW')
     callee = self._value()
     if self._consume('!'):
-      return RyNode('Call', line, callee=callee, args=[])
+      return Call(line, callee=callee, args=[])
     if new and callee is False:
       self._expected('object name', line)
     args = []
@@ -336,23 +722,25 @@ class Reader:
       # and it was not an object instantiation, don't
       # touch anything.
       return callee
-    return RyNode('Instance' if new is not False else 'Call', line, callee=callee, args=args)
+    return (Instance if new is not False else Call)(line, callee=callee, args=args)
 
+  @_packrat
   def _prefix(self):
     # prefix ::= `switches/prefixes` prefix -> Call(callee, [1]args)
     #   | call
     line = self.line
-    operator = self._consume(*self.switches['prefixes'])
+    operator = self._consume(*self.switches.prefixes)
     if operator is not False:
       operand = self._prefix()
       if operand is False:
         self._expected(f'a value to follow prefix "{operator.value}"', line)
       # NOTE: prefixes are function calls after parsing!
-      return RyNode('Call', line,
-        callee = RyNode('Request', line, name=f'\'{operator.value.lower()}'),
+      return Call(line,
+        callee = Request(line, name=f'\'{operator.value.lower()}'),
         args = [operand])
     return self._call()
 
+  @_packrat
   def _infix(self, depth=0):
     # infix ::= prefix `switches/precedence` infix -> Call(callee, [2]args)
     #   / False
@@ -361,7 +749,7 @@ class Reader:
     if left is False:
       return False
     while True:
-      assoc, prec = self.switches['precedence'].get(self.token.type, (0, 0))
+      assoc, prec = self.switches.precedence.get(self.token.type, (0, 0))
       if depth >= prec:
         return left
       infix = self._consume(self.token.type).type
@@ -370,13 +758,14 @@ class Reader:
       if right is False:
         self._expected('right hand side of an expression', line)
       # NOTE: infixes are function calls after parsing, too!
-      left = RyNode('Call', line,
-        callee = RyNode('Request', line, name=f'\'{infix.lower()}'),
+      left = Call(line,
+        callee = Request(line, name=f'\'{infix.lower()}'),
         args = [left, right])
     return left
 
   #| Patterns:
 
+  @_packrat
   def _pattern_guard(self):
     # pattern_guard ::= ID ("," infix | <operator with precedence=switches/guard-precedence> value)
     #   -> P_Guard(param, guard)
@@ -390,21 +779,21 @@ class Reader:
       guard = self._infix()
       if guard is False:
         self._expected('a guarding expression', line)
-      return RyNode('P_Guard', line, param=param.value, guard=guard)
+      return P_Guard(line, param=param.value, guard=guard)
     #- Nuclear guards, e.g., "(x in [1 2 3])", or "(x not of num)"
-    infix = self._consume(
-      *[x for x, p in self.switches['precedence'].items() if p[1] == self.switches['guard-precedence']])
+    infix = self._consume(*self.switches.guard_operators)
     if infix is not False:
       value = self._value()
       if value is False:
         self._expected('a value', line)
-      return RyNode('P_Guard', line,
+      return P_Guard(line,
         param = param.value,
-        guard = RyNode('Call', line,
-          callee = RyNode('Request', line, name=f'\'{infix.type.lower()}'),
-          args = [RyNode('Request', line, name=param.value), value]))
+        guard = Call(line,
+          callee = Request(line, name=f'\'{infix.type.lower()}'),
+          args = [Request(line, name=param.value), value]))
     return False
 
+  @_packrat
   def _pattern_extract(self):
     # pattern_extract ::= ID {pattern} -> P_Extract(obj, []fields)
     #   / False
@@ -415,8 +804,9 @@ class Reader:
     fields = self._kleene_until(')', self._pattern, chop=False)
     if fields is False:
       return False
-    return RyNode('P_Extract', line, obj=obj.value, fields=fields)
+    return P_Extract(line, obj=obj.value, fields=fields)
 
+  @_packrat
   def _pattern_multi(self):
     # pattern_multi ::= "(" "*" ")" -> P_DiscardMany
     #   | "(" "+" ")" -> P_DiscardMulti
@@ -430,22 +820,42 @@ class Reader:
         return False
       if self._consume(')') is False:
         self._expected('")"')
-      return RyNode('P_DiscardMany' if unnamed.type == '*' else 'P_DiscardMulti', line)
+      return (P_DiscardMany if unnamed.type == '*' else P_DiscardMulti)(line)
     name = self._consume('ID')
     if name is False:
       return False
     if self._consume('+'):
-      return RyNode('P_NamedMulti', line, name=name.value)
+      return P_NamedMulti(line, name=name.value)
     elif self._consume('*'):
-      return RyNode('P_NamedMany', line, name=name.value)
+      return P_NamedMany(line, name=name.value)
     else:
       return False
 
+  def _pattern_key(self):
+    # pattern_key ::= ID -> Request(name)
+    #   | NUM -> Number(value)
+    #   | STR -> String(value)
+    #   / False
+    # (What else the patterns of a vector may start with, a key must not:
+    # `[(*) x]` is not a dict, and must not be read as if it were.)
+    line = self.line
+    token = self._consume('ID', 'NUM', 'STR')
+    if token is False:
+      return False
+    elif token.type == 'ID':
+      return Request(line, name=token.value)
+    elif token.type == 'NUM':
+      return Number(line, value=token.value)
+    return _string(line, token.value)
+
+  @_packrat
   def _pattern(self):
     # pattern ::= ID -> P_Identifier(name)
     #   | (NUM | STR) -> P_Compare(value)
     #   | _ -> P_Discard
     #   | "[" (pattern | pattern_multi)+ "]" -> P_Unpack([]members)
+    #   | "[" "=>" "]" -> P_Compare(Dict)
+    #   | "[" (pattern_key "=>" pattern)+ "]" -> P_DictExtract([]keys, []fields)
     #   | "(" (pattern_guard | pattern_extract) ")"
     #   / False
     line = self.line
@@ -453,11 +863,17 @@ class Reader:
     if token is False:
       return False
     if token.type == '[':
+      pairs = self._pairs(self._pattern_key, self._pattern)
+      if pairs == []:
+        return P_Compare(line, value=Dict(line, keys=[], values=[]))
+      elif pairs is not False:
+        keys, fields = zip(*pairs)
+        return P_DictExtract(line, keys=[*keys], fields=[*fields])
       members = self._kleene_until(']', lambda: self._any_of(self._pattern_multi, self._pattern))
       if not members:
         # XXX: too manual?
-        return RyNode('P_Compare', line, value=RyNode('Vector', line, items=[]))
-      return RyNode('P_Unpack', line, members=members)
+        return P_Compare(line, value=Vector(line, items=[]))
+      return P_Unpack(line, members=members)
     elif token.type == '(':
       inside = self._any_of(self._pattern_guard, self._pattern_extract)
       if inside is False:
@@ -466,15 +882,27 @@ class Reader:
         self._expected('")"', line)
       return inside
     elif token.type == 'ID':
-      return RyNode('P_Identifier', line, name=token.value)
+      return P_Identifier(line, name=token.value)
     elif token.type in ('NUM', 'STR'):
       if token.type == 'NUM':
-        node = RyNode('Number', line, value=token.value)
+        node = Number(line, value=token.value)
       else:
-        node = RyNode('String', line, value=token.value[1:-1])
-      return RyNode('P_Compare', line, value=node)
+        node = _string(line, token.value)
+      return P_Compare(line, value=node)
     elif token.type == '_':
-      return RyNode('P_Discard', line)
+      return P_Discard(line)
+
+  @_packrat
+  def _patterns(self):
+    # patterns ::= {pattern} -> []patterns
+    # (The prefix `_function` and `_assign` share. In packrat mode, the one
+    # tried second finds it read already.)
+    patterns = []
+    while True:
+      pattern = self._isolate(self._pattern)
+      if pattern is False:
+        return patterns
+      patterns.append(pattern)
 
   #| Block:
 
@@ -485,7 +913,7 @@ class Reader:
     if self._consume('{') is False:
       return False
     while True:
-      term = self.next('}')
+      term = self._next('}')
       if not term:
         break
       terms.append(term)
@@ -499,29 +927,31 @@ class Reader:
     # assign ::= [pattern except guard] "=" infix -> Assign(pattern, value)
     #   / False
     line = self.line
-    pattern = self._pattern()
-    if pattern is False or not self._consume('='):
+    patterns = self._patterns()
+    if len(patterns) != 1 or not self._consume('='):
       return False
+    pattern, = patterns
     if pattern.type == 'P_Guard':
       self._die('top-level guards forbidden in assignment', line)
     value = self._infix()
     if value is False:
       self._expected('a value', line)
-    return RyNode('Assign', line, pattern=pattern, value=value)
+    return Assign(line, pattern=pattern, value=value)
 
   def _function(self):
-    # function ::= SLURPY? QUOTING? NAKED? ID {pattern} "->" (infix | block)
-    #   -> Function(name, ~quoting, ~naked, []params, iter body)
+    # function ::= SLURPY? QUOTING? ID {pattern} "->" (infix | block)
+    #   -> Function(name, ~quoting, []params, iter body)
     #   / False
     line = self.line
     slurpy = self._consume('SLURPY')
     quoting = self._consume('QUOTING')
-    naked = self._consume('NAKED')
-    name = self._consume('ID')
-    if name is False:
+    name = self.token
+    if name.type != 'ID':
       return False
-    params = self._kleene_until('->', self._pattern)
-    if params is False:
+    # The name is read as a pattern, too, so that the patterns read here are
+    # those `_assign` reads.
+    _, *params = self._patterns()
+    if self._consume('->') is False:
       return False
     if name.value.startswith('\''):
       arity = self._for_argc[-1] + len(params) if self._for_argc else len(params)
@@ -534,15 +964,13 @@ class Reader:
         self.add_operator(value.upper(), 'left', self.precedence)
       elif arity == 1:
         self.add_prefix(value.upper())
-      self.update_symbol_regex()
     body = self._term() if self._consume('NL') else self._any_of(self._block, self._infix)
     if body is False:
       self._expected('function body', line, got=False)
-    return RyNode('Function', line,
+    return Function(line,
       name = name.value,
       params = params,
       slurpy = slurpy is not False,
-      naked = naked is not False,
       quoting = quoting is not False,
       body = [body] if type(body) is not list else body)
 
@@ -571,7 +999,7 @@ class Reader:
     self._for_argc.pop()
     for function in functions:
       function.set('params', params + function.params)
-    return RyNode('ForBlock', line, functions=functions)
+    return ForBlock(line, functions=functions)
 
   def _umbrella(self):
     # umbrella ::= UMBRELLA ID FOR ID+ -> Umbrella(name, []covers)
@@ -588,7 +1016,7 @@ class Reader:
     objects = self._kleene_until('NL', lambda: self._consume('ID'), chop=False)
     if not objects:
       self._expected('at least one object', line, got=False)
-    return RyNode('Umbrella', line, name=name.value, covers=[obj.value for obj in objects])
+    return Umbrella(line, name=name.value, covers=[obj.value for obj in objects])
 
   def _obj(self):
     # obj ::= [SECRET] OBJ pattern+ [block]
@@ -607,7 +1035,7 @@ class Reader:
       if property_ is False:
         break
       properties.append(property_)
-    return RyNode('Object', line,
+    return Object(line,
       name = name.value,
       secret = secret is not False,
       properties = properties,
@@ -619,7 +1047,7 @@ class Reader:
     line = self.line
     if self._consume('RET') is False:
       return False
-    return RyNode('Ret', line,
+    return Ret(line,
       value = self._infix() or self._expected('a value to return', line))
 
   def _needs(self):
@@ -633,7 +1061,7 @@ class Reader:
     if module is False:
       self._expected('dependency name', line, got=False)
     exposed = self._consume('EXPOSED')
-    return RyNode('Needs', line,
+    return Needs(line,
       module = module.value[1:-1] if module.type == 'STR' else module.value,
       hidden = hidden is not False,
       expose = exposed is not False)
@@ -644,7 +1072,7 @@ class Reader:
     line = self.line
     if self._consume('EXPECT') is False:
       return False
-    return RyNode('Expect', line, guard=self._infix() or self._expected('an expression', line))
+    return Expect(line, guard=self._infix() or self._expected('an expression', line))
 
   def _case_pattern(self):
     # case_pattern ::= pattern:pattern "->" -> ('pattern', pattern)
@@ -678,7 +1106,7 @@ class Reader:
     body = self._any_of(self._block, self._infix)
     if body is False:
       self._expected('case body - an expression or a block', line)
-    return RyNode('MatchCase' if cond[0] == 'pattern' else 'ValueCase', line,
+    return (MatchCase if cond[0] == 'pattern' else ValueCase)(line,
       cond = cond[1],
       body = body if type(body) is list else [body])
 
@@ -699,7 +1127,7 @@ class Reader:
       self._expected('one case or multiple cases separated by newline(s)', line)
     if not cases: # empty cases block
       self._expected('at least one case', line, got=False)
-    return RyNode('Cases', line, head=head, cases=cases)
+    return Cases(line, head=head, cases=cases)
 
   def _if(self):
     # if ::= IF infix block [ELSE block] -> If(cond, []correct, []other)
@@ -718,7 +1146,7 @@ class Reader:
       other = self._block()
       if other is False:
         self._expected('a block')
-    return RyNode('If', line, cond=cond, correct=correct, other=other)
+    return If(line, cond=cond, correct=correct, other=other)
 
   def _term(self):
     return self._any_of(
@@ -734,14 +1162,43 @@ class Reader:
       self._assign,
       self._infix)
 
-  def next(self, stopper='EOF'):
+  def next(self):
     """Proceed to read the next top-level node. Return False if reached the end."""
+    self._forget()
+    cache = self._cache
+    if cache is None:
+      return self._next()
+    fingerprint = self.fingerprint()
+    replayed = cache.replay(fingerprint)
+    if replayed is not None:
+      node, journal = replayed
+      for method, args in journal:
+        getattr(self, method)(*args)
+      return node
+    if cache.resume is not None:
+      # Diverged from the cached nodes, so read this one and those that
+      # follow it anew.
+      self._restart(*cache.resume)
+    start = self._start()
+    self._journal = []
+    try:
+      node = self._next()
+      cache.record(fingerprint, start, node, self._journal)
+    finally:
+      self._journal = None
+    if node is False:
+      cache.save()
+    return node
+
+  def _next(self, stopper='EOF'):
+    """Read the next term of the current block (the top-level one if the
+       stopper is EOF). Return False if reached the stopper."""
     if self.token.type == 'BOL':
-      self.token = self._progress()
+      self._advance()
     if self.token.type == stopper:
       return False
     if self._consume('NL'):
-      return self.next()
+      return self._next()
     line = self.line
     term = self._term()
     if term is False:
@@ -0,0 +1,64 @@
+from os import getcwd
+from pathlib import Path
+
+
+class Module:
+  """A module, evaluated: the `state` it was evaluated in, what it `exports`,
+     the `switches` of the reader that read it (the grammar it leaves to those
+     who need it), and the time its file was last modified at when it was
+     evaluated."""
+
+  __slots__ = 'state', 'exports', 'switches', 'mtime'
+
+  def __init__(self, state, exports, switches, mtime):
+    self.state = state
+    self.exports = exports
+    self.switches = switches
+    self.mtime = mtime
+
+
+class Registry:
+  """The modules a process evaluated, by their absolute paths.
+
+  A module is evaluated for the first `needs` of it; every other `needs` of it,
+  by any master, is served what it exported then (each master seeing it
+  through an overlay of its own, see `_needs`). The paths the names `needs`
+  asks for were found at are remembered too, so PATH is probed once per name.
+
+  A long-running process (think of the REPL) may `check` that the files of the
+  modules did not change since: a path is then looked for again if its file is
+  gone, and a module is evaluated again if its file was modified."""
+
+  def __init__(self):
+    self.modules = {}
+    self.paths = {}
+    # The paths of the modules being evaluated; one of them needing another
+    # one of them would never end.
+    self.loading = set()
+
+  def resolve(self, locations, filename, check=False):
+    """Return the absolute path of `filename` in the first of the `locations`
+       (a `;`-separated PATH) that has it, or None if none does."""
+    key = getcwd(), locations, filename
+    path = self.paths.get(key)
+    if path is None or check and not path.exists():
+      for location in locations.split(';'):
+        path = (Path(location) / filename).absolute()
+        if path.exists():
+          self.paths[key] = path
+          return path
+      return None
+    return path
+
+  def get(self, path, check=False):
+    """Return the Module at `path`, or None if it was not evaluated yet (or,
+       if `check`, if its file was modified since it was)."""
+    module = self.modules.get(path)
+    if module is not None and check and path.stat().st_mtime_ns != module.mtime:
+      return None
+    return module
+
+  def add(self, path, state, exports, switches, mtime):
+    """Register the module at `path`, evaluated; return it."""
+    self.modules[path] = module = Module(state, exports, switches, mtime)
+    return module
@@ -0,0 +1,486 @@
+"""
+The bytecode engine of Rydesta. Nodes are compiled into Code: flat lists of
+instructions, each an opcode and its argument, with a pool of constants that
+arguments refer to. Code is run by a dispatch loop, which keeps the frames of
+the functions (and excerpts) it evaluates on a stack of its own, never on that
+of Python. So recursion is as deep as memory allows, and calls in tail position
+replace the frame of the caller.
+"""
+
+from .machine import (
+  RyBool, RyVec, RyNothing, RyExcerpt, RyBuiltin, RyTypeType, RyVariations,
+  _ReturnException, _die, _equals, _visit_pattern,
+  _CaseTable, _plan_cases, _define, _define_object, _needs, _convert, _dispatch,
+  _call_builtin, _instantiate, _builtin, _route, _constant, _string, _dict)
+
+
+###- INSTRUCTIONS -##############
+
+OPCODES = (
+  'LINE',          # line         S.line = line
+  'LOAD',          # name         push the value of the variable
+  'CONST',         # value        push a constant value
+  'STRING',        # node         push the value of the String node (interpolated)
+  'BOOL',          # 0/1          push false/true
+  'NOTHING',       # -            push nothing
+  'BUILTIN',       # name         push a builtin
+  'ROUTE',         # path         pop a routeable, push what the path leads to
+  'VECTOR',        # count        pop that many values, push a vec of them
+  'DICT',          # count        pop that many keys and values, push a dict of them
+  'POP',           # -            pop a value
+  'JUMP',          # target       go to the target
+  'JUMP_IF_FALSE', # target       pop a value; if it is false, go to the target
+  'MATCH',         # pattern      match the top value; push whether it matched
+  'EQUALS',        # -            pop a value; push whether it equals the top one
+  'JUMP_UNLESS',   # target       pop whether matched; if it did not, go to the target
+  'SWITCH',        # (table, targets)  if the table has a case equal to the top value,
+                   #              go to the target of that case
+  'ASSIGN',        # pattern      match the top value, or die
+  'DEFINE',        # (node, code) define a function; push its variations
+  'OBJECT',        # node         define an object; push nothing
+  'NEEDS',         # node         evaluate a module; push nothing
+  'EXPECT',        # -            pop a value; die if it is false; push nothing
+  'QUOTE',         # node         push an excerpt of the node
+  'UNQUOTE',       # -            pop an excerpt; evaluate it in a frame of its own
+  'QUOTING',       # (nodes, target)  if the top value quotes, push excerpts of the
+                   #              argument nodes, and go to the target (the call)
+  'CALL',          # node         pop the arguments of the Call node, and a callee; call it
+  'TAIL_CALL',     # node         same, but the callee's frame replaces this one
+  'INSTANCE',      # count        pop that many arguments and an object; instantiate it
+  'RET',           # -            pop a value; return it from the function
+  'RETURN',        # -            pop a value; return it from the frame
+)
+
+for _opcode, _name in enumerate(OPCODES):
+  globals()[_name] = _opcode
+
+
+class Code:
+  """Compiled nodes. `ops` holds two words per instruction: an opcode, and the
+     argument, which is either an immediate or an index into `constants`."""
+
+  __slots__ = 'name', 'ops', 'constants'
+
+  # Opcodes whose argument is an index into `constants`.
+  POOLED = {
+    LOAD, CONST, STRING, BUILTIN, ROUTE, MATCH, ASSIGN, DEFINE, OBJECT, NEEDS,
+    QUOTE, QUOTING, CALL, TAIL_CALL, SWITCH}
+
+  def __init__(self, name, ops, constants):
+    self.name = name
+    self.ops = ops
+    self.constants = constants
+
+  def dis(self):
+    """Disassemble the code, and the code of the functions it defines."""
+    lines, nested = [f'code {self.name}:'], []
+    for pc in range(0, len(self.ops), 2):
+      op, arg = self.ops[pc], self.ops[pc + 1]
+      line = f'  {pc:>5} {OPCODES[op]:<14}'
+      if op in Code.POOLED:
+        constant = self.constants[arg]
+        if op == DEFINE:
+          node, code = constant
+          if code is not None:
+            nested.append(code)
+          constant = node.name
+        elif op == QUOTING:
+          constant = f'{len(constant[0])} argument(s), to {constant[1]}'
+        elif op in (CALL, TAIL_CALL):
+          constant = f'{len(constant.args)} argument(s)'
+        elif op == SWITCH:
+          constant = f'{len(constant[0].cases)} case(s), to {", ".join(map(str, constant[1].values()))}'
+        line += f'{arg:<4} ({constant})'
+      elif op not in (POP, EQUALS, EXPECT, UNQUOTE, RET, RETURN, NOTHING):
+        line += str(arg)
+      lines.append(line.rstrip())
+    return '\n'.join([*lines, *(code.dis() for code in nested)])
+
+  def __repr__(self):
+    return f'[code {self.name}]'
+
+
+###- COMPILER -##############
+
+class _Assembler:
+  """Collects the instructions and constants of a Code being compiled."""
+
+  # Instructions that leave S.line as it is.
+  KEEP_LINE = {
+    LINE, LOAD, CONST, STRING, BOOL, NOTHING, BUILTIN, ROUTE, VECTOR, DICT, POP,
+    QUOTE, QUOTING, EQUALS, DEFINE, OBJECT}
+
+  def __init__(self, name):
+    self.name = name
+    self.ops = []
+    self.constants = []
+    self._pooled = {}
+    self._line = None # S.line when here, if known
+
+  def constant(self, value):
+    """Pool the constant; nodes and code are pooled by identity."""
+    key = (type(value), value) if type(value) in (str, int) else id(value)
+    if key not in self._pooled:
+      self._pooled[key] = len(self.constants)
+      self.constants.append(value)
+    return self._pooled[key]
+
+  def emit(self, op, arg=0):
+    """Append an instruction; return the position of its argument, to patch.
+       A LINE that would not change S.line is left out."""
+    if op == LINE:
+      if self._line == arg:
+        return
+      self._line = arg
+    elif op not in _Assembler.KEEP_LINE:
+      self._line = None
+    self.ops += op, arg
+    return len(self.ops) - 1
+
+  def label(self):
+    """Return the position here, to be jumped to. Paths join here, and S.line
+       is no longer known."""
+    self._line = None
+    return len(self.ops)
+
+  def patch(self, at):
+    """Make the jump whose argument is at `at` go here."""
+    self.ops[at] = self.label()
+
+  def code(self):
+    return Code(self.name, self.ops, self.constants)
+
+
+def compile_node(node):
+  """Compile a top-level node (or an excerpt) into Code; it is kept in the
+     node, and compiled only once."""
+  try:
+    return node.code
+  except AttributeError:
+    asm = _Assembler(f'{node.type.lower()} at line {node.line}')
+    _compile(asm, node, False)
+    asm.emit(RETURN)
+    node.code = code = asm.code()
+    return code
+
+
+def _compile_function_body(node):
+  """Compile the body of a Function node, or return None if it is empty."""
+  if not node.body:
+    return None
+  asm = _Assembler(f'{node.name} at line {node.line}')
+  last = node.body[-1]
+  # Ignore the last-line return.
+  _compile_body(asm, [*node.body[:-1], last.value if last.type == 'Ret' else last], True)
+  asm.emit(RETURN)
+  return asm.code()
+
+
+def _compile_body(asm, nodes, tail):
+  """Compile a non-empty list of nodes; leave the value of the last one."""
+  for node in nodes[:-1]:
+    _compile(asm, node, False)
+    asm.emit(POP)
+  _compile(asm, nodes[-1], tail)
+
+
+def _compile_branch(asm, nodes, tail, empty):
+  """Compile the body of a branch; if it is empty, it evaluates to `empty`."""
+  if nodes:
+    _compile_body(asm, nodes, tail)
+  else:
+    asm.emit(BOOL, empty)
+
+
+def _compile(asm, node, tail):
+  """Compile a node. If it is in `tail` position of a function body, calls
+     it makes last are tail calls, and `ret` is its value."""
+  if node.type == 'Ret' and tail:
+    # A `ret` the body ends with is what the body evaluates to.
+    return _compile(asm, node.value, True)
+  asm.emit(LINE, node.line)
+  if node.type == 'Request':
+    asm.emit(LOAD, asm.constant(node.name))
+  elif node.type == 'Call':
+    # Special forms look like calls, but are not calls.
+    if node.callee.type == 'Request' and len(node.args) == 1:
+      if node.callee.name == 'unquote':
+        _compile(asm, node.args[0], False)
+        return asm.emit(UNQUOTE)
+      elif node.callee.name == 'quote':
+        return asm.emit(QUOTE, asm.constant(node.args[0]))
+    _compile(asm, node.callee, False)
+    # Builtins never quote.
+    quoting = node.callee.type != 'Builtin' and [node.args, None]
+    if quoting:
+      asm.emit(QUOTING, asm.constant(quoting))
+    for arg in node.args:
+      _compile(asm, arg, False)
+    if quoting:
+      quoting[1] = asm.label()
+    asm.emit(TAIL_CALL if tail else CALL, asm.constant(node))
+  elif node.type in ('Number', 'String', 'Vector') and _constant(node) is not None:
+    asm.emit(CONST, asm.constant(_constant(node)))
+  elif node.type == 'String':
+    asm.emit(STRING, asm.constant(node))
+  elif node.type == 'Vector':
+    for item in node.items:
+      _compile(asm, item, False)
+    asm.emit(VECTOR, len(node.items))
+  elif node.type == 'Dict':
+    for key, value in zip(node.keys, node.values):
+      _compile(asm, key, False)
+      _compile(asm, value, False)
+    asm.emit(DICT, len(node.keys))
+  elif node.type == 'If':
+    _compile(asm, node.cond, False)
+    other = asm.emit(JUMP_IF_FALSE)
+    _compile_branch(asm, node.correct, tail, 1)
+    end = asm.emit(JUMP)
+    asm.patch(other)
+    # If there is no `else` clause and the condition is false, return false.
+    _compile_branch(asm, node.other, tail, 0)
+    asm.patch(end)
+  elif node.type == 'Cases':
+    _compile(asm, node.head, False)
+    ends = []
+    for case in _plan_cases(node):
+      following = None
+      if type(case) is _CaseTable:
+        targets = {}
+        asm.emit(SWITCH, asm.constant((case, targets)))
+        following = asm.emit(JUMP)
+        for each in case.cases:
+          targets[each] = asm.label()
+          asm.emit(POP)
+          _compile_branch(asm, each.body, tail, 1)
+          ends.append(asm.emit(JUMP))
+        asm.patch(following)
+        continue
+      elif case.type == 'ValueCase':
+        _compile(asm, case.cond, False)
+        asm.emit(EQUALS)
+        following = asm.emit(JUMP_UNLESS)
+      # In cases, P_Discard has the highest priority.
+      elif case.cond.type != 'P_Discard':
+        asm.emit(MATCH, asm.constant(case.cond))
+        following = asm.emit(JUMP_UNLESS)
+      asm.emit(POP)
+      _compile_branch(asm, case.body, tail, 1)
+      ends.append(asm.emit(JUMP))
+      if following is None:
+        break # the cases after this one are unreachable
+      asm.patch(following)
+    else:
+      asm.emit(POP)
+      asm.emit(BOOL, 0)
+    for end in ends:
+      asm.patch(end)
+  elif node.type == 'Assign':
+    _compile(asm, node.value, False)
+    asm.emit(ASSIGN, asm.constant(node.pattern))
+  elif node.type == 'Function':
+    asm.emit(DEFINE, asm.constant((node, _compile_function_body(node))))
+  elif node.type == 'ForBlock':
+    _compile_body(asm, node.functions, False)
+  elif node.type == 'Path':
+    _compile(asm, node.parent, False)
+    asm.emit(ROUTE, asm.constant(node.path))
+  elif node.type == 'Builtin':
+    asm.emit(BUILTIN, asm.constant(node.name))
+  elif node.type == 'Instance':
+    _compile(asm, node.callee, False)
+    for arg in node.args:
+      _compile(asm, arg, False)
+    asm.emit(INSTANCE, len(node.args))
+  elif node.type == 'Ret':
+    _compile(asm, node.value, False)
+    asm.emit(RET)
+  elif node.type == 'Expect':
+    _compile(asm, node.guard, False)
+    asm.emit(EXPECT)
+  elif node.type == 'Object':
+    asm.emit(OBJECT, asm.constant(node))
+  elif node.type == 'Needs':
+    asm.emit(NEEDS, asm.constant(node))
+  else:
+    raise NotImplementedError(f'internal error: .compile: {node}')
+
+
+###- MACHINE -##############
+
+# How many frames deep the machine may go, unless its master says otherwise.
+DEPTH = 100_000
+
+
+def evaluate(S, node):
+  """Evaluate a node (or a list of nodes) in the given state, compiling it
+     first if it was not yet."""
+  if type(node) in (list, tuple):
+    return [evaluate(S, x) for x in node]
+  try:
+    return execute(compile_node(node), S)
+  except RecursionError:
+    # Guards (and the like) the machine evaluates are run by machines of their
+    # own, on the stack of Python; so are the guards they call, and so on.
+    _die(S, 'recursion error: recursion too deep :(')
+
+
+def disassemble(node):
+  """Compile a node, and return its disassembly."""
+  return compile_node(node).dis()
+
+
+def execute(code, S):
+  """Run the code in the given state, and return the value it leaves."""
+  # The frame being run is in the locals; those below it are in `frames`, as
+  # tuples of the same locals. `function` tells a frame of a function body
+  # from the others (that of `code`, and those of excerpts).
+  frames = []
+  depth = DEPTH if S.master is None else S.master.depth
+  ops, constants, pc, stack, function = code.ops, code.constants, 0, [], False
+  while True:
+    op = ops[pc]
+    arg = ops[pc + 1]
+    pc += 2
+    if op == LINE:
+      S.line = arg
+    elif op == LOAD:
+      try:
+        stack.append(S.env[constants[arg]])
+      except KeyError:
+        _die(S, f'"{constants[arg]}" is not defined')
+    elif op == QUOTING:
+      callee = stack[-1]
+      if isinstance(callee, RyVariations) and callee.quoting:
+        # Quoting functions excerpt all arguments they received, without evaluation.
+        nodes, pc = constants[arg]
+        stack += [RyExcerpt(S, node) for node in nodes]
+    elif op == CALL or op == TAIL_CALL:
+      site = constants[arg]
+      count = len(site.args)
+      if count:
+        args = stack[-count:]
+        del stack[-count:]
+      else:
+        args = []
+      callee = stack.pop()
+      if isinstance(callee, RyVariations):
+        variation, capsule = _dispatch(S, callee, args, site)
+        if variation.code is None:
+          stack.append(RyNothing())
+          continue
+        if op == CALL:
+          if len(frames) == depth:
+            _die(S, f'recursion error: recursion deeper than {depth} frames :(')
+          frames.append((ops, constants, pc, stack, S, function))
+        code = variation.code
+        ops, constants, pc, stack, S, function = code.ops, code.constants, 0, [], capsule, True
+      elif isinstance(callee, RyBuiltin):
+        stack.append(_call_builtin(S, callee, args))
+      elif isinstance(callee, RyTypeType) and len(args) == 1:
+        stack.append(_convert(S, callee, args[0]))
+      else:
+        _die(S, f'callee of type {callee.type} is not callable: {callee}')
+    elif op == RETURN:
+      value = stack.pop()
+      if not frames:
+        return value
+      ops, constants, pc, stack, S, function = frames.pop()
+      stack.append(value)
+    elif op == CONST:
+      stack.append(constants[arg])
+    elif op == POP:
+      stack.pop()
+    elif op == JUMP_IF_FALSE:
+      value = stack.pop()
+      if isinstance(value, RyBool) and value.value is False:
+        pc = arg
+    elif op == JUMP:
+      pc = arg
+    elif op == MATCH:
+      stack.append(_visit_pattern(S, constants[arg], stack[-1])[0])
+    elif op == EQUALS:
+      value = stack.pop()
+      stack.append(_equals(value, stack[-1]))
+    elif op == JUMP_UNLESS:
+      if not stack.pop():
+        pc = arg
+    elif op == SWITCH:
+      table, targets = constants[arg]
+      case = table.pick(S, stack[-1])
+      if case is not None:
+        pc = targets[case]
+    elif op == STRING:
+      stack.append(_string(S, constants[arg]))
+    elif op == VECTOR:
+      if arg:
+        items = stack[-arg:]
+        del stack[-arg:]
+      else:
+        items = []
+      stack.append(RyVec(items))
+    elif op == DICT:
+      if arg:
+        items = stack[-2 * arg:]
+        del stack[-2 * arg:]
+      else:
+        items = []
+      stack.append(_dict(S, zip(items[::2], items[1::2])))
+    elif op == BOOL:
+      stack.append(RyBool(bool(arg)))
+    elif op == NOTHING:
+      stack.append(RyNothing())
+    elif op == ASSIGN:
+      status, payload = _visit_pattern(S, constants[arg], stack[-1])
+      if not status:
+        _die(S, f'match error: {payload}')
+    elif op == DEFINE:
+      node, body = constants[arg]
+      stack.append(_define(S, node, body))
+    elif op == UNQUOTE:
+      quoted = stack.pop()
+      if not isinstance(quoted, RyExcerpt):
+        _die(S, f'cannot unquote a non-excerpt value: {quoted}')
+      elif len(frames) == depth:
+        _die(S, f'recursion error: recursion deeper than {depth} frames :(')
+      frames.append((ops, constants, pc, stack, S, function))
+      code = compile_node(quoted.node)
+      ops, constants, pc, stack, S, function = code.ops, code.constants, 0, [], quoted.state.child(), False
+    elif op == QUOTE:
+      stack.append(RyExcerpt(S, constants[arg]))
+    elif op == RET:
+      value = stack.pop()
+      # Leave the frames up to (and including) the function's.
+      while not function:
+        if not frames:
+          raise _ReturnException(value)
+        ops, constants, pc, stack, S, function = frames.pop()
+      if not frames:
+        return value
+      ops, constants, pc, stack, S, function = frames.pop()
+      stack.append(value)
+    elif op == ROUTE:
+      stack.append(_route(S, stack.pop(), constants[arg]))
+    elif op == BUILTIN:
+      stack.append(_builtin(S, constants[arg]))
+    elif op == INSTANCE:
+      if arg:
+        args = stack[-arg:]
+        del stack[-arg:]
+      else:
+        args = []
+      obj = stack.pop()
+      stack.append(_instantiate(S, obj, args))
+    elif op == EXPECT:
+      # Die if the guard is false.
+      guard = stack.pop()
+      if isinstance(guard, RyBool) and guard.value == False:
+        _die(S, f'expectation false')
+      stack.append(RyNothing())
+    elif op == OBJECT:
+      stack.append(_define_object(S, constants[arg]))
+    elif op == NEEDS:
+      stack.append(_needs(S, constants[arg]))
+    else:
+      raise NotImplementedError(f'internal error: .execute: {OPCODES[op]}')